@@ -1,15 +1,90 @@
+import functools
 import json
 import os
-from dotenv import load_dotenv
-load_dotenv()
+import random
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from serpapi import GoogleSearch
+from category_knowledge import CategoryKnowledgeBase
+from instrumentation import (StageClock, capture_raw_response, configure_logging, configure_profiling, count, log,
+                             span, stage_timer, traced, tracing)
+from preferences_store import PreferencesStore
+from price_history import PriceHistory, search_key
+from product_index import ProductIndex
+from result_index import ResultIndex
+from serp_cache import SerpCache
+from serpapi_client import SerpApiClient, SerpApiError, SerpApiTimeout
+from sheets_client import SheetsClientManager
 
-SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 GOOGLE_CREDS_FILE = "product-support-463118-9cfaa594d984.json"
 PREFERENCES_FILE = "preferences.json"
+PREFERENCES_DB = "preferences.db"
+SERP_CACHE_FILE = "serp_cache.db"
+CATEGORY_KNOWLEDGE_FILE = "category_knowledge.db"
+EXTRACTION_CACHE_FILE = "extraction_cache.db"
+PRICE_HISTORY_DB = "price_history.db"
+KNOWN_CATEGORIES = ["laptop", "smartphone", "composter"] # Categories with specific built-in knowledge
+SERPAPI_TIMEOUT = 20 # Seconds per SerpAPI request
+EXPLORATORY_MAX_QUERIES = 4 # Broad query plus up to 3 attribute variants
+SERPAPI_PAGE_SIZE = 40 # Results requested per page ("num")
+SEARCH_TARGET_RESULTS = 10 # Stop paging once this many products pass the filters
+SEARCH_MAX_PAGES = 3
+SEARCH_TIME_BUDGET = 30 # Seconds; no new page is requested after this
+
+# Heavy dependencies (requests, gspread/oauth2client, numpy) and the .env file are loaded
+# on first use, so the menu appears without paying for the Google auth stack.
+@functools.lru_cache(maxsize=None)
+def load_env():
+    """Reads .env into the environment once."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def serpapi_key():
+    """SerpAPI key from the environment or .env."""
+    load_env()
+    return os.getenv("SERPAPI_KEY")
+
+@functools.lru_cache(maxsize=None)
+def serpapi_client():
+    """
+    SerpAPI client shared by every search in this process: pooled connections, retries with
+    jittered backoff, a circuit breaker and (with SERPAPI_RATE_LIMIT, searches per second) a quota guard.
+    """
+    load_env()
+    rate = os.getenv("SERPAPI_RATE_LIMIT")
+    return SerpApiClient(
+        timeout=SERPAPI_TIMEOUT,
+        max_retries=int(os.getenv("SERPAPI_MAX_RETRIES", 2)),
+        failure_threshold=int(os.getenv("SERPAPI_BREAKER_THRESHOLD", 5)),
+        cooldown=float(os.getenv("SERPAPI_BREAKER_COOLDOWN", 30)),
+        rate=float(rate) if rate else None,
+        pool_size=int(os.getenv("SERPAPI_POOL_SIZE", 8)),
+    )
+
+@functools.lru_cache(maxsize=None)
+def serp_cache():
+    """Cache of raw SerpAPI responses, so repeated and recalled searches skip the API call."""
+    load_env()
+    return SerpCache(
+        SERP_CACHE_FILE,
+        ttl=int(os.getenv("SERP_CACHE_TTL", 6 * 3600)),
+        stale_ttl=int(os.getenv("SERP_CACHE_STALE_TTL", 24 * 3600)),
+        max_entries=int(os.getenv("SERP_CACHE_MAX_ENTRIES", 500)),
+    )
+
+@functools.lru_cache(maxsize=None)
+def category_knowledge():
+    """Memoized category summaries and suggested attributes, so each category costs one model call."""
+    load_env()
+    return CategoryKnowledgeBase(
+        CATEGORY_KNOWLEDGE_FILE,
+        generate=lambda category: (simulate_llm_summarize(category), suggest_attributes(category)),
+        ttl=int(os.getenv("CATEGORY_KNOWLEDGE_TTL", 30 * 86400)),
+        known_categories=KNOWN_CATEGORIES,
+    )
 
 # Gemini Initialization (GPT imitation for text analysis)
 # If you want to use a real Gemini API, uncomment the following lines
@@ -20,13 +95,106 @@ PREFERENCES_FILE = "preferences.json"
 # except Exception as e:
 #     print(f"[WARN] Failed to initialize Gemini model: {e}. Using built-in simulation.")
 #     model = None # Set to None if initialization failed
+# Feature extraction has its own, batched Gemini backend: set EXTRACTION_BACKEND=gemini (see extraction_backend()).
+
+# Saved user preferences (opened on first use; categories from an old preferences.json are imported once)
+SAVED_PREFERENCES = PreferencesStore(PREFERENCES_DB, legacy_json=PREFERENCES_FILE)
+# Prices seen by every search, to report what changed since the same search last ran
+PRICE_HISTORY = PriceHistory(PRICE_HISTORY_DB)
+
+# ------------------------
+# Feature Extraction Rules
+# ------------------------
+# Each rule maps keywords (English and Russian synonyms) to an attribute value. A rule only
+# looks at one field: the product title or the snippet (field=None would match either).
+# Rules sharing a group are mutually exclusive; the one listed first wins.
+# Attributes starting with "_" are markers used only by "requires".
+FeatureRule = namedtuple("FeatureRule", ["attribute", "value", "keywords", "group", "requires", "field"])
+
+def _rules(attribute, value, title=(), snippet=(), group=None, requires=None):
+    """One rule per field that has keywords: title keywords first, then snippet keywords."""
+    return [
+        FeatureRule(attribute, value, tuple(k.lower() for k in keywords), group or attribute, requires, field)
+        for field, keywords in (("title", title), ("snippet", snippet)) if keywords
+    ]
+
+FEATURE_RULES = [
+    # General attributes
+    *_rules("electric", True, title=["electric"], snippet=["электрический"]),
+    *_rules("quietness", True, title=["quiet"], snippet=["бесшумный", "silent"]),
+    *_rules("wireless", True, title=["wireless"], snippet=["беспроводной"]),
+    *_rules("waterproof", True, title=["waterproof"], snippet=["водонепроницаемый"]),
+    *_rules("compact", True, title=["compact"], snippet=["компактный"]),
+    *_rules("portable", True, title=["portable"], snippet=["портативный"]),
+    *_rules("durable", True, title=["durable"], snippet=["долговечный"]),
 
-# Load saved user preferences
-if os.path.exists(PREFERENCES_FILE):
-    with open(PREFERENCES_FILE, "r", encoding="utf-8") as f:
-        SAVED_PREFERENCES = json.load(f)
-else:
-    SAVED_PREFERENCES = {}
+    # Attributes for laptops
+    *_rules("_cpu_brand", True, title=["intel", "amd"]),
+    *_rules("cpu", "intel i3", title=["i3"], requires="_cpu_brand"),
+    *_rules("cpu", "intel i5", title=["i5"], requires="_cpu_brand"),
+    *_rules("cpu", "intel i7", title=["i7"], requires="_cpu_brand"),
+    *_rules("cpu", "intel i9", title=["i9"], requires="_cpu_brand"),
+    *_rules("cpu", "amd ryzen 3", title=["ryzen 3"], requires="_cpu_brand"),
+    *_rules("cpu", "amd ryzen 5", title=["ryzen 5"], requires="_cpu_brand"),
+    *_rules("cpu", "amd ryzen 7", title=["ryzen 7"], requires="_cpu_brand"),
+    *_rules("cpu", "amd ryzen 9", title=["ryzen 9"], requires="_cpu_brand"),
+    *_rules("ram", "4gb", title=["4gb ram"], snippet=["4гб озу"]),
+    *_rules("ram", "8gb", title=["8gb ram"], snippet=["8гб озу"]),
+    *_rules("ram", "16gb", title=["16gb ram"], snippet=["16гб озу"]),
+    *_rules("ram", "32gb", title=["32gb ram"], snippet=["32гб озу"]),
+    *_rules("storage", "128gb ssd", title=["128gb ssd"], snippet=["128гб ssd"]),
+    *_rules("storage", "256gb ssd", title=["256gb ssd"], snippet=["256гб ssd"]),
+    *_rules("storage", "512gb ssd", title=["512gb ssd"], snippet=["512гб ssd"]),
+    *_rules("storage", "1tb ssd", title=["1tb ssd"], snippet=["1тб ssd"]),
+    *_rules("storage_type", "hdd", title=["hdd"], snippet=["жесткий диск"], group="storage"),
+    *_rules("gpu", "dedicated", title=["nvidia", "geforce", "rtx", "radeon"]),
+    *_rules("gpu", "integrated", snippet=["integrated graphics", "intel iris", "встроенная графика"]),
+    *_rules("screen_size", "13 inch", title=["13 inch", '13"']),
+    *_rules("screen_size", "14 inch", title=["14 inch", '14"']),
+    *_rules("screen_size", "15 inch", title=["15 inch", '15"']),
+    *_rules("screen_size", "17 inch", title=["17 inch", '17"']),
+    *_rules("touchscreen", True, title=["touchscreen"], snippet=["сенсорный экран"]),
+    *_rules("resolution", "4k", title=["4k"], snippet=["uhd"]),
+    *_rules("resolution", "full hd", title=["full hd"], snippet=["fhd"]),
+    *_rules("battery_life", "long", snippet=["long battery life", "10+ hours", "долгая работа от батареи"]),
+
+    # Attributes for composters
+    *_rules("bin_size", "large", title=["large capacity"], snippet=["большая емкость", "10l"]),
+    *_rules("bin_size", "small", title=["compact", "small", "маленький"]),
+    *_rules("odor_control", True, title=["odor control"], snippet=["контроль запаха", "odorless"]),
+    *_rules("subscription_required", False, title=["no subscription"], snippet=["без подписки"]),
+]
+
+_FIELDS = ("title", "snippet")
+
+def _compile_feature_matcher(rules):
+    """
+    Builds a keyword -> (title rule indexes, snippet rule indexes) table and one alternation
+    regex over all keywords. The regex is wrapped in a lookahead so matches starting at every
+    position are reported, and a keyword also credits every shorter keyword it starts with
+    ("intel iris" -> "intel").
+    """
+    keyword_rules = {}
+    for rule_id, rule in enumerate(rules):
+        for keyword in rule.keywords:
+            per_field = keyword_rules.setdefault(keyword, tuple(set() for _ in _FIELDS))
+            for i, field in enumerate(_FIELDS):
+                if rule.field in (None, field):
+                    per_field[i].add(rule_id)
+
+    expanded = {}
+    for keyword in keyword_rules:
+        rule_ids = tuple(set() for _ in _FIELDS)
+        for other, other_ids in keyword_rules.items():
+            if keyword.startswith(other):
+                for ids, more in zip(rule_ids, other_ids):
+                    ids |= more
+        expanded[keyword] = tuple(frozenset(ids) for ids in rule_ids)
+
+    alternation = "|".join(re.escape(k) for k in sorted(expanded, key=len, reverse=True))
+    return expanded, re.compile(f"(?=({alternation}))")
+
+_KEYWORD_RULES, _FEATURE_MATCHER = _compile_feature_matcher(FEATURE_RULES)
 
 # ------------------------
 # Helper Functions
@@ -99,198 +267,658 @@ def simulate_llm_extract_features(product_title, description=""):
     Simulates product feature extraction using an LLM (e.g., Gemini/GPT).
     Adapted for general and specific attributes.
     """
-    # If a real Gemini model is initialized (and uncommented above)
-    # if 'model' in globals() and model:
-    #     try:
-    #         response = model.generate_content(f"Extract key attributes and their values from this product title and description. Return as a JSON string with attribute: value pairs. Title: {product_title}. Description: {description}")
-    #         return json.loads(response.text)
-    #     except (json.JSONDecodeError, Exception) as e:
-    #         print(f"[WARN] LLM returned invalid JSON or an error occurred: {e} for {product_title}. Using built-in simulation.")
+    # Uses the Gemini backend if EXTRACTION_BACKEND=gemini, the keyword rules otherwise
+    return extraction_backend().extract([(product_title, description)])[0]
 
-    features = {}
-    title_lower = product_title.lower()
-    description_lower = description.lower()
+def extract_features_batch(items):
+    """
+    Rule-based feature extraction for many products at once.
+    Takes a list of (title, snippet) pairs and returns a list of attribute dicts,
+    scanning the concatenated text once with the compiled keyword matcher.
+    """
+    if not items:
+        return []
 
-    # General attributes
-    if "electric" in title_lower or "электрический" in description_lower:
-        features["electric"] = True
-    if "quiet" in title_lower or "бесшумный" in description_lower or "silent" in description_lower:
-        features["quietness"] = True
-    if "wireless" in title_lower or "беспроводной" in description_lower:
-        features["wireless"] = True
-    if "waterproof" in title_lower or "водонепроницаемый" in description_lower:
-        features["waterproof"] = True
-    if "compact" in title_lower or "компактный" in description_lower:
-        features["compact"] = True
-    if "portable" in title_lower or "портативный" in description_lower:
-        features["portable"] = True
-    if "durable" in title_lower or "долговечный" in description_lower:
-        features["durable"] = True
-    
-    # Attributes for laptops
-    if any(cpu_brand in title_lower for cpu_brand in ["intel", "amd"]) and \
-       any(cpu_model in title_lower for cpu_model in ["i3", "i5", "i7", "i9", "ryzen 3", "ryzen 5", "ryzen 7", "ryzen 9"]):
-        if "i3" in title_lower: features["cpu"] = "intel i3"
-        elif "i5" in title_lower: features["cpu"] = "intel i5"
-        elif "i7" in title_lower: features["cpu"] = "intel i7"
-        elif "i9" in title_lower: features["cpu"] = "intel i9"
-        elif "ryzen 3" in title_lower: features["cpu"] = "amd ryzen 3"
-        elif "ryzen 5" in title_lower: features["cpu"] = "amd ryzen 5"
-        elif "ryzen 7" in title_lower: features["cpu"] = "amd ryzen 7"
-        elif "ryzen 9" in title_lower: features["cpu"] = "amd ryzen 9"
-        elif "ryzen" in title_lower: features["cpu"] = "amd ryzen"
-        elif "intel" in title_lower: features["cpu"] = "intel"
-
-    if "4gb ram" in title_lower or "4гб озу" in description_lower: features["ram"] = "4gb"
-    elif "8gb ram" in title_lower or "8гб озу" in description_lower: features["ram"] = "8gb"
-    elif "16gb ram" in title_lower or "16гб озу" in description_lower: features["ram"] = "16gb"
-    elif "32gb ram" in title_lower or "32гб озу" in description_lower: features["ram"] = "32gb"
-
-    if "128gb ssd" in title_lower or "128гб ssd" in description_lower: features["storage"] = "128gb ssd"
-    elif "256gb ssd" in title_lower or "256гб ssd" in description_lower: features["storage"] = "256gb ssd"
-    elif "512gb ssd" in title_lower or "512гб ssd" in description_lower: features["storage"] = "512gb ssd"
-    elif "1tb ssd" in title_lower or "1тб ssd" in description_lower: features["storage"] = "1tb ssd"
-    elif "hdd" in title_lower or "жесткий диск" in description_lower: features["storage_type"] = "hdd"
-
-    if "nvidia" in title_lower or "geforce" in title_lower or "rtx" in title_lower or "radeon" in title_lower:
-        features["gpu"] = "dedicated"
-    elif "integrated graphics" in description_lower or "intel iris" in description_lower:
-        features["gpu"] = "integrated"
-
-    if "13 inch" in title_lower or "13\"" in title_lower: features["screen_size"] = "13 inch"
-    elif "14 inch" in title_lower or "14\"" in title_lower: features["screen_size"] = "14 inch"
-    elif "15 inch" in title_lower or "15\"" in title_lower: features["screen_size"] = "15 inch"
-    elif "17 inch" in title_lower or "17\"" in title_lower: features["screen_size"] = "17 inch"
-    if "touchscreen" in title_lower or "сенсорный экран" in description_lower: features["touchscreen"] = True
-    if "4k" in title_lower or "uhd" in description_lower: features["resolution"] = "4k"
-    elif "full hd" in title_lower or "fhd" in description_lower: features["resolution"] = "full hd"
-
-    if "long battery life" in description_lower or "10+ hours" in description_lower: features["battery_life"] = "long"
-    
-    # Attributes for composters
-    if "large capacity" in title_lower or "большая емкость" in description_lower or "10l" in description_lower:
-        features["bin_size"] = "large"
-    elif "compact" in title_lower or "маленький" in title_lower or "small" in title_lower:
-        features["bin_size"] = "small"
-    if "odor control" in title_lower or "контроль запаха" in description_lower or "odorless" in description_lower:
-        features["odor_control"] = True
-    if "no subscription" in title_lower or "без подписки" in description_lower:
-        features["subscription_required"] = False
-    
+    texts = []
+    offsets = []
+    title_ends = [] # Matches before this position are in the title, later ones in the snippet
+    position = 0
+    for title, description in items:
+        title = (title or "").lower()
+        text = f"{title}\n{(description or '').lower()}"
+        offsets.append(position)
+        title_ends.append(position + len(title))
+        texts.append(text)
+        position += len(text) + 1
+    corpus = "\x00".join(texts)
+
+    hits = [set() for _ in items]
+    item_index = 0
+    next_offset = offsets[1] if len(offsets) > 1 else None
+    for match in _FEATURE_MATCHER.finditer(corpus):
+        start = match.start()
+        while next_offset is not None and start >= next_offset:
+            item_index += 1
+            next_offset = offsets[item_index + 1] if item_index + 1 < len(offsets) else None
+        hits[item_index].update(_KEYWORD_RULES[match.group(1)][start >= title_ends[item_index]])
+
+    return [_resolve_feature_rules(rule_ids) for rule_ids in hits]
+
+def _resolve_feature_rules(rule_ids):
+    """Turns the set of matched rule indexes into an attribute dict (lowest index wins per group)."""
+    features = {}
+    taken_groups = set()
+    for rule_id in sorted(rule_ids):
+        rule = FEATURE_RULES[rule_id]
+        if rule.group in taken_groups:
+            continue
+        if rule.requires and not any(FEATURE_RULES[r].group == rule.requires for r in rule_ids):
+            continue
+        taken_groups.add(rule.group)
+        if not rule.attribute.startswith("_"):
+            features[rule.attribute] = rule.value
     return features
 
+def feature_vocabulary():
+    """attribute -> values the keyword rules can produce; model answers are restricted to these."""
+    vocabulary = {}
+    for rule in FEATURE_RULES:
+        values = vocabulary.setdefault(rule.attribute, []) if not rule.attribute.startswith("_") else None
+        if values is not None and rule.value not in values:
+            values.append(rule.value)
+    return vocabulary
+
+@functools.lru_cache(maxsize=None)
+def extraction_backend():
+    """
+    Feature extractor used by the pipeline: the keyword rules by default, or Gemini with
+    EXTRACTION_BACKEND=gemini (batched prompts, rate-limited, cached, rules as the fallback).
+    """
+    from extraction import ExtractionCache, LLMBackend, RuleBasedBackend
+
+    load_env()
+    rules = RuleBasedBackend(extract_features_batch)
+    if os.getenv("EXTRACTION_BACKEND", "rules").lower() != "gemini":
+        return rules
+    model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        model = genai.GenerativeModel(model_name)
+    except Exception as e:
+        log.warning("Failed to initialize Gemini model: %s. Using rule-based extraction.", e)
+        return rules
+    return LLMBackend(
+        model,
+        fallback=rules,
+        vocabulary=feature_vocabulary(),
+        cache=ExtractionCache(EXTRACTION_CACHE_FILE),
+        batch_size=int(os.getenv("GEMINI_BATCH_SIZE", 20)),
+        max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 4)),
+        requests_per_second=float(os.getenv("GEMINI_QPS", 2)),
+        tokens_per_minute=int(os.getenv("GEMINI_TOKENS_PER_MINUTE", 250000)),
+        timeout=float(os.getenv("EXTRACTION_TIMEOUT", 15)),
+        model_name=model_name,
+    )
+
 # ------------------------
 # Search Products in Google Shopping
 # ------------------------
-def search_google_products(category, keywords=[], attributes={}):
+def set_serpapi_rate_limit(rate, burst=None):
+    """Limits SerpAPI requests from this process to `rate` per second (None removes the limit)."""
+    serpapi_client().set_rate_limit(rate, burst)
+
+def _serpapi_fetch(params, timeout=None):
+    """Runs one blocking SerpAPI search within `timeout` seconds; raises SerpApiError if it fails."""
+    results = serpapi_client().search(params, timeout or SERPAPI_TIMEOUT)
+    capture_raw_response(params, results) # No-op unless SERPAPI_CAPTURE_FILE is set
+    return results
+
+@traced()
+def search_google_products(category, keywords=[], attributes={}, query_suffix="", timeout=None):
     """
     Searches for products on Google Shopping, filtering by keywords and simulating attribute filtering.
+    `query_suffix` adds search terms to the query without filtering results by them.
+    Raises SerpApiError when the search fails, so a failure is never mistaken for "no products".
+    """
+    filtered = list(search_products_stream(category, keywords, attributes, query_suffix, timeout))
+    log.debug("After filtering: %d", len(filtered))
+    return filtered
+
+def print_search_error(error):
+    """Tells the user the search itself failed (as opposed to finding nothing)."""
+    print(f"❌ The Google Shopping search failed: {error}")
+    if error.retry_after:
+        print(f"   Please try again in about {error.retry_after:.0f} seconds.")
+    else:
+        print("   Please try again shortly.")
+
+# ------------------------
+# Streaming Search Pipeline
+# ------------------------
+# fetch -> parse -> extract -> filter (-> score) -> sinks. Every stage is a generator,
+# so products reach the sinks while later pages are still being fetched and processed.
+EXTRACT_BATCH_SIZE = 50 # Products per extraction batch
+SHEETS_STREAM_BUFFER = 500 # Rows buffered by the Sheets sink before each write
+
+def fetch_stage(category, keywords=[], query_suffix="", timeout=None,
+                max_pages=1, enough=None, time_budget=None, status=None):
+    """
+    Yields raw `shopping_results` lists, one per result page.
+    Further pages are requested until `enough()` returns True, `max_pages` pages have been fetched,
+    SerpAPI reports no next page, or `time_budget` seconds have passed. Once a page has come back
+    short of the target, the next one is fetched in the background while the caller processes it.
+    If a `status` dict is given, status["complete"] becomes True once the last result page was fetched.
     """
+    status = {} if status is None else status
+    status["complete"] = False
     search_term = category + " " + " ".join(keywords)
+    if query_suffix:
+        search_term = search_term.strip() + " " + query_suffix
     params = {
         "engine": "google",
         "q": search_term.strip(),
         "tbm": "shop",  # Google Shopping
-        "api_key": SERPAPI_KEY
+        "num": SERPAPI_PAGE_SIZE,
+        "api_key": serpapi_key()
     }
 
-    print(f"\n[DEBUG] Performing search query: '{search_term}'")
+    log.debug("Performing search query: '%s'", search_term)
 
+    def fetch_page(page):
+        page_params = dict(params, start=page * SERPAPI_PAGE_SIZE) if page else params
+        with stage_timer("api_call", query=params["q"], page=page + 1):
+            return serp_cache().get_or_fetch(page_params, lambda: _serpapi_fetch(page_params, timeout))
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serpapi-prefetch")
+    prefetch = enough is None # With a target, page 1 alone is often enough: don't pay for page 2 up front
     try:
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        print(f"\n[DEBUG] Raw SerpAPI Response: {json.dumps(results, indent=2, ensure_ascii=False)}")
+        future = prefetcher.submit(fetch_page, 0)
+        for page in range(max_pages):
+            results = future.result()
+            products = results.get("shopping_results", [])
+            log.debug("Products found: %d (page %d)", len(products), page + 1)
 
-        products = results.get("shopping_results", [])
-        print(f"\n[DEBUG] Products found: {len(products)}")
+            # SerpAPI leaves out the pagination block on the last page
+            has_next = bool(products) and "next" in results.get("serpapi_pagination", {})
+            status["complete"] = not has_next
+            in_budget = deadline is None or time.monotonic() < deadline
+            more = has_next and in_budget and page + 1 < max_pages
+            future = None
+            if more and prefetch:
+                future = prefetcher.submit(fetch_page, page + 1) # Prefetch while this page is filtered
 
-        filtered = []
-        for p in products:
-            title = p.get("title", "")
-            description = p.get("snippet", "") # Using snippet as description for attribute extraction
+            yield products
 
-            # Check by main keywords
-            if keywords:
-                if not all(word.lower() in title.lower() or word.lower() in description.lower() for word in keywords):
-                    continue
+            if not more or (enough and enough()):
+                break
+            prefetch = True # This page fell short; later pages are likely needed too
+            if future is None:
+                future = prefetcher.submit(fetch_page, page + 1)
+    finally:
+        prefetcher.shutdown(wait=False, cancel_futures=True)
 
-            # Simulate LLM product feature categorization and filtering
-            product_attributes = simulate_llm_extract_features(title, description)
-            
-            # Check if product matches explicit user attributes
-            match_attributes = True
-            for attr_key, attr_value in attributes.items():
-                if attr_key not in product_attributes or product_attributes[attr_key] != attr_value:
-                    match_attributes = False
-                    break
-            if not match_attributes:
+def parse_stage(pages, keywords=[]):
+    """
+    Applies the keyword filter and yields, per result page, the list of its unique products.
+    Listings of a product already yielded on an earlier page are dropped.
+    """
+    keywords_lower = [word.lower() for word in keywords]
+    index = ProductIndex()
+    emitted = set()
+    for page in pages:
+        with stage_timer("parse", listings=len(page)) as timing:
+            new_ids = _parse_page(page, keywords_lower, index, emitted)
+            timing["products"] = len(new_ids)
+        yield [index.get(cid) for cid in new_ids]
+
+def _parse_page(page, keywords_lower, index, emitted):
+    """Adds one page of raw listings to the index and returns the IDs of products not seen before."""
+    new_ids = []
+    for p in page:
+        # Check by main keywords
+        title = p.get("title", "")
+        description = p.get("snippet", "") # Using snippet as description for attribute extraction
+        if keywords_lower and not all(word in title.lower() or word in description.lower() for word in keywords_lower):
+            continue
+
+        # Group listings of the same product (several stores, repeated entries) before any further work
+        cid = index.add({
+            "name": title,
+            "price": p.get("extracted_price", "N/A"),
+            "url": p.get("link"),
+            "source": p.get("source"),
+            "image": p.get("thumbnail"),
+            "description": description,
+        })
+        if cid not in emitted:
+            emitted.add(cid)
+            new_ids.append(cid)
+    return new_ids
+
+def extract_stage(pages, batch_size=EXTRACT_BATCH_SIZE):
+    """
+    Adds extracted attributes and yields products one at a time, running the feature matcher
+    over batches of at most `batch_size` products. Batches never span two pages, so the next
+    page is not requested before every product of the current one has been passed on.
+    """
+    for page in pages:
+        for offset in range(0, len(page), batch_size):
+            yield from _extract_batch(page[offset:offset + batch_size])
+
+def _extract_batch(batch):
+    # Simulate LLM product feature categorization (one pass over all titles and snippets)
+    with stage_timer("extract", products=len(batch)):
+        extracted = extraction_backend().extract([(p["name"] or "", p.get("description", "")) for p in batch])
+    for product, product_attributes in zip(batch, extracted):
+        product["attributes"] = product_attributes # Add extracted attributes for later use
+        yield product
+
+def filter_stage(products, attributes={}):
+    """Yields only products whose extracted attributes match every explicit user attribute."""
+    clock = StageClock("filter")
+    checked = passed = 0
+    try:
+        for product in products:
+            with clock.step():
+                product_attributes = product["attributes"]
+                matches = all(attr_key in product_attributes and product_attributes[attr_key] == attr_value
+                              for attr_key, attr_value in attributes.items())
+            checked += 1
+            if matches:
+                passed += 1
+                yield product
+    finally:
+        clock.report(products=checked, passed=passed)
+
+def index_stage(products, index):
+    """Adds every extracted product to a ResultIndex (before filtering) and passes it on."""
+    for product in products:
+        index.add(product)
+        yield product
+
+def search_products_stream(category, keywords=[], attributes={}, query_suffix="", timeout=None,
+                           target=None, max_pages=None, time_budget=None, index=None, status=None):
+    """
+    Lazily yields filtered products for a search, one at a time.
+    More result pages are fetched only while fewer than `target` products have passed the filters.
+    If a ResultIndex is given, every fetched product (also those the filters reject) is added to it.
+    If a `status` dict is given, status["complete"] tells afterwards whether every result page was
+    fetched (False when the search stopped early at `target`, `max_pages` or `time_budget`).
+    """
+    target = SEARCH_TARGET_RESULTS if target is None else target
+    max_pages = SEARCH_MAX_PAGES if max_pages is None else max_pages
+    time_budget = SEARCH_TIME_BUDGET if time_budget is None else time_budget
+    passed = [0]
+
+    def counted(products):
+        for product in products:
+            passed[0] += 1
+            yield product
+
+    pages = fetch_stage(category, keywords, query_suffix, timeout,
+                        max_pages=max_pages, enough=lambda: passed[0] >= target, time_budget=time_budget,
+                        status=status)
+    products = extract_stage(parse_stage(pages, keywords))
+    if index is not None:
+        products = index_stage(products, index)
+    return counted(filter_stage(products, attributes))
+
+class ConsoleSink:
+    """Prints the first `limit` products as soon as they arrive and counts the rest."""
+
+    def __init__(self, title, limit=5):
+        self.title = title
+        self.limit = limit
+        self.count = 0
+
+    def add(self, product):
+        self.count += 1
+        if self.count == 1:
+            print(f"\n{self.title}")
+        if self.count <= self.limit:
+            p = product
+            print(f" {self.count}. {p['name']} | Price: {p['price']} | Store: {p['source']}\n    Link: {p['url']}")
+            if p['attributes']:
+                print(f"    Detected attributes: {p['attributes']}")
+
+    def close(self):
+        if self.count > self.limit:
+            print(f"    ... and {self.count - self.limit} more.")
+
+class SheetExportSink:
+    """
+    Streams products into a Google Sheet in buffered chunks of `buffer_size` rows.
+    Nothing is written until more than `auto_export_after` products have arrived; if the stream
+    ends before that, `confirm()` decides whether the few buffered products are exported.
+    """
+
+    def __init__(self, sheet_name, auto_export_after=5, confirm=None, buffer_size=SHEETS_STREAM_BUFFER):
+        self.sheet_name = sheet_name
+        self.auto_export_after = auto_export_after
+        self.confirm = confirm
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+        self.spreadsheet = None
+        self.sheet = None
+        self.headers = None
+        self.next_row = 2
+
+    def add(self, product):
+        self.count += 1
+        self.buffer.append(product)
+        # Start writing as soon as there are more results than the console shows, then once per full buffer
+        if self.count > self.auto_export_after and (self.sheet is None or len(self.buffer) >= self.buffer_size):
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.sheet is None:
+            self.spreadsheet, self.sheet = _open_sheet(self.sheet_name)
+            _sheets_call(self.sheet.clear) # Clear the sheet before writing new data
+        headers = _sheet_headers(self.buffer, self.headers)
+        rows = _sheet_rows(self.buffer, headers)
+        _write_sheet_rows(self.sheet, headers, self.headers, rows, self.next_row)
+        self.headers = headers
+        self.next_row += len(rows)
+        self.buffer = []
+
+    def abort(self):
+        """The search failed: drop the buffered rows without asking or writing anything more."""
+        written = self.count - len(self.buffer)
+        self.buffer = []
+        if self.sheet is not None:
+            print(f"[!] Export stopped; the Google Sheet has only the first {written} rows: {self.spreadsheet.url}")
+
+    def close(self):
+        if self.sheet is None:
+            if not self.buffer or not (self.confirm and self.confirm()):
+                return
+        self.flush()
+        print(f"[✔] Google Sheet successfully updated/created ({self.count} rows): {self.spreadsheet.url}")
+
+class CollectSink:
+    """Keeps every product, for callers that need the full list afterwards."""
+
+    def __init__(self):
+        self.products = []
+
+    def add(self, product):
+        self.products.append(product)
+
+    def close(self):
+        pass
+
+class PriceHistorySink:
+    """
+    Keeps every product and, when the stream ends, records the run in PRICE_HISTORY.
+    Pass the same `status` dict to search_products_stream, so a search that stopped early
+    doesn't report the products it never reached as no longer listed.
+    """
+
+    def __init__(self, search, announce=True):
+        self.search = search
+        self.announce = announce
+        self.products = []
+        self.changes = None
+        self.status = {"complete": True}
+
+    def add(self, product):
+        self.products.append(product)
+
+    def abort(self):
+        pass # A partial run would report every product it missed as no longer listed
+
+    def close(self):
+        try:
+            self.changes = PRICE_HISTORY.record(self.search, self.products, complete=self.status.get("complete", True))
+        except Exception as e:
+            log.warning("Could not record price history: %s", e)
+            return
+        if self.announce:
+            print_price_changes(self.changes)
+
+def print_price_changes(changes):
+    """Prints what changed since the previous run of the same search."""
+    if changes is None or changes.baseline is None:
+        return
+    since = datetime.fromtimestamp(changes.baseline).strftime("%Y-%m-%d %H:%M")
+    if not (changes.new or changes.removed or changes.repriced):
+        print(f"\n[ℹ️] No changes since the last search ({since}).")
+        return
+    print(f"\n📈 Changes since the last search ({since}): {len(changes.new)} new, "
+          f"{len(changes.repriced)} repriced, {len(changes.removed)} no longer listed")
+    for product, old_price, new_price in sorted(changes.repriced, key=lambda c: c[2] - c[1])[:5]:
+        arrow = "📉" if new_price < old_price else "📈"
+        print(f" {arrow} {product['name']}: {old_price:.2f} -> {new_price:.2f}")
+    for product in changes.new[:3]:
+        print(f" 🆕 {product['name']} | Price: {product['price']}")
+
+def run_pipeline(products, sinks):
+    """
+    Feeds every product to each sink as it arrives; returns the number of products.
+    If the stream fails, sinks with an abort() are aborted, the others closed, and the error re-raised.
+    """
+    count = 0
+    try:
+        for product in products:
+            count += 1
+            for sink in sinks:
+                sink.add(product)
+    except Exception:
+        for sink in sinks:
+            getattr(sink, "abort", sink.close)()
+        raise
+    for sink in sinks:
+        sink.close()
+    return count
+
+# ------------------------
+# Concurrent Multi-Query Search
+# ------------------------
+def iter_search_fanout(queries, max_concurrency=4, timeout=None):
+    """
+    Runs several searches concurrently and yields (query, products) as each one finishes.
+    Each query is a dict with "category" and optional "keywords", "attributes" and "query_suffix".
+    At most `max_concurrency` SerpAPI requests are in flight; `timeout` is the per-query limit in seconds.
+    """
+    timeout = timeout or SERPAPI_TIMEOUT
+    queries = list(queries)
+    if not queries:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="serpapi")
+    futures = {
+        executor.submit(
+            search_google_products,
+            q["category"],
+            q.get("keywords", []),
+            q.get("attributes", {}),
+            q.get("query_suffix", ""),
+            timeout,
+        ): q
+        for q in queries
+    }
+    # A query fetches up to SEARCH_MAX_PAGES pages, each within `timeout`, but requests no new
+    # page after SEARCH_TIME_BUDGET; queued queries wait for a free worker first
+    per_query = min(SEARCH_MAX_PAGES * timeout, SEARCH_TIME_BUDGET + timeout)
+    waves = -(-len(queries) // max_concurrency)
+    failures = []
+    answered = skipped = 0
+    try:
+        for future in as_completed(futures, timeout=per_query * waves + 5):
+            try:
+                products = future.result()
+            except SerpApiError as e:
+                log.warning("Search query '%s' failed: %s", _query_label(futures[future]), e)
+                failures.append(e)
                 continue
+            answered += 1
+            yield futures[future], products
+    except FuturesTimeoutError:
+        skipped = sum(1 for f in futures if not f.done())
+        log.warning("%d of %d search queries timed out and were skipped.", skipped, len(queries))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    # No query answered: that is an outage, not an empty result
+    if not answered and failures:
+        raise failures[0]
+    if not answered and skipped:
+        raise SerpApiTimeout(f"None of the {len(queries)} search queries finished in time")
 
-            filtered.append({
-                "name": p.get("title"),
-                "price": p.get("extracted_price", "N/A"),
-                "url": p.get("link"),
-                "source": p.get("source"),
-                "image": p.get("thumbnail"),
-                "attributes": product_attributes # Add extracted attributes for later use
-            })
+def _query_label(query):
+    return " ".join([query["category"], *query.get("keywords", []), query.get("query_suffix", "")]).strip()
 
-        print(f"[DEBUG] After filtering: {len(filtered)}")
-        return filtered
+def search_google_products_fanout(queries, max_concurrency=4, timeout=None):
+    """Runs several searches concurrently and returns the merged list of unique products."""
+    index = ProductIndex()
+    for _, products in iter_search_fanout(queries, max_concurrency, timeout):
+        index.add_many(products)
+    log.debug("Fan-out search merged %d unique products from %d queries", len(index), len(queries))
+    return index.products()
 
-    except Exception as e:
-        print(f"[ERROR] Error during Google Shopping search: {e}")
-        return []
+def attribute_query_terms(attribute):
+    """
+    Search terms that tend to surface products having `attribute`: the first keyword of its first rule.
+    Attributes with several values (cpu, ram, storage, screen size...) get None: any one value
+    would fetch only that variant (often the lowest, which scoring then ranks last), so the
+    broad query covers them.
+    """
+    rules = [rule for rule in FEATURE_RULES if rule.attribute == attribute]
+    if len({rule.value for rule in rules}) != 1:
+        return None
+    return rules[0].keywords[0]
 
 # ------------------------
 # Export to Google Sheets (Story A3, Story B5)
 # ------------------------
-def export_to_gsheet(data, sheet_name="Shopping Results"):
-    """Exports data to a Google Sheet."""
-    if not data:
-        print("[!] No data to export.")
-        return
+SHEETS_CHUNK_ROWS = 2000 # Rows sent per write request
+SHEETS_MAX_RETRIES = 5
+SHEET_BASE_HEADERS = ["name", "price", "price_max", "url", "source", "stores", "image"]
+SHEETS_SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_CREDS_FILE, scope)
-    client = gspread.authorize(creds)
+# Authorized once and shared by every export in this process
+SHEETS_CLIENT = SheetsClientManager(GOOGLE_CREDS_FILE, SHEETS_SCOPE)
 
-    try:
-        # Check if a sheet with this name already exists
-        spreadsheet = client.open(sheet_name)
-        print(f"[ℹ️] Updating existing Google Sheet: {spreadsheet.url}")
-    except gspread.exceptions.SpreadsheetNotFound:
-        # If not, create a new one
-        spreadsheet = client.create(sheet_name)
-        print(f"[✔] New Google Sheet created: {spreadsheet.url}")
-    
-    sheet = spreadsheet.sheet1 # Get the first sheet
-    sheet.clear() # Clear the sheet before writing new data
+def _sheets_call(func, *args, **kwargs):
+    """Runs a Sheets API call, retrying with exponential backoff on quota and server errors."""
+    import gspread
 
-    # Prepare headers, including all unique attributes
-    base_headers = ["name", "price", "url", "source", "image"]
+    for attempt in range(SHEETS_MAX_RETRIES):
+        count("api_calls.sheets")
+        try:
+            return func(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(e.response, "status_code", None)
+            if status not in (429, 500, 502, 503) or attempt == SHEETS_MAX_RETRIES - 1:
+                raise
+            delay = min(2 ** attempt, 32) + random.uniform(0, 1)
+            log.warning("Google Sheets returned %s, retrying in %.1fs...", status, delay)
+            time.sleep(delay)
+
+def _sheet_headers(data, existing_headers=None):
+    """Header row: base columns followed by every attribute key (new keys are appended to existing headers)."""
     all_attributes_keys = set()
     for item in data:
         if "attributes" in item:
             all_attributes_keys.update(item["attributes"].keys())
-    
-    final_headers = base_headers + sorted(list(all_attributes_keys)) # Attributes in columns
 
-    sheet.insert_row(final_headers, 1)
+    if existing_headers:
+        return existing_headers + sorted(all_attributes_keys - set(existing_headers))
+    return SHEET_BASE_HEADERS + sorted(all_attributes_keys) # Attributes in columns
+
+def _sheet_cell(value):
+    return ", ".join(str(v) for v in value) if isinstance(value, (list, tuple)) else str(value)
 
-    # Populate data
+def _sheet_rows(data, headers):
+    """Builds the value matrix for `data` in header order."""
+    rows = []
     for row_data in data:
+        attributes = row_data.get("attributes", {})
         row_values = []
-        for header in final_headers:
+        for header in headers:
             if header in row_data:
-                row_values.append(str(row_data[header]))
-            elif "attributes" in row_data and header in row_data["attributes"]:
-                row_values.append(str(row_data["attributes"][header]))
+                row_values.append(_sheet_cell(row_data[header])) # "stores" is a list
+            elif header in attributes:
+                row_values.append(_sheet_cell(attributes[header]))
             else:
                 row_values.append("") # Empty string if attribute is missing
-        sheet.append_row(row_values)
+        rows.append(row_values)
+    return rows
+
+def _open_sheet(sheet_name):
+    """Returns the first worksheet of `sheet_name`, creating the spreadsheet if it doesn't exist."""
+    # Reuses the process-wide client and cached spreadsheet handles
+    with span("sheets.open", sheet=sheet_name) as fields:
+        spreadsheet, created = _sheets_call(SHEETS_CLIENT.open_or_create, sheet_name)
+        fields["created"] = created
+    if created:
+        print(f"[✔] New Google Sheet created: {spreadsheet.url}")
+    else:
+        print(f"[ℹ️] Updating existing Google Sheet: {spreadsheet.url}")
+    return spreadsheet, spreadsheet.sheet1 # Get the first sheet
+
+@traced("sheets.write_rows")
+def _write_sheet_rows(sheet, headers, previous_headers, rows, start_row):
+    """Writes `rows` from `start_row` on (plus the header row if it changed) in chunked batch requests."""
+    if tracing():
+        count("api_bytes.sheets", sum(len(value.encode("utf-8")) for row in rows for value in row))
+    # Grow the grid once up front if the data does not fit
+    needed_rows = start_row + len(rows) - 1
+    if needed_rows > sheet.row_count or len(headers) > sheet.col_count:
+        _sheets_call(sheet.resize, rows=max(needed_rows, sheet.row_count), cols=max(len(headers), sheet.col_count))
+
+    # Header row (rewritten only if it changed) goes out together with the first chunk of data
+    updates = []
+    if headers != previous_headers:
+        updates.append({"range": "A1", "values": [headers]})
+    for offset in range(0, len(rows), SHEETS_CHUNK_ROWS):
+        updates.append({"range": f"A{start_row + offset}", "values": rows[offset:offset + SHEETS_CHUNK_ROWS]})
+        _sheets_call(sheet.batch_update, updates)
+        updates = []
+    if updates:
+        _sheets_call(sheet.batch_update, updates)
+
+@traced()
+def export_to_gsheet(data, sheet_name="Shopping Results", append=False):
+    """
+    Exports data to a Google Sheet.
+    All rows are written with a few batched requests instead of one request per row.
+    With append=True the sheet is not cleared and only products whose URL is not already present are added.
+    """
+    if not data:
+        print("[!] No data to export.")
+        return
+
+    spreadsheet, sheet = _open_sheet(sheet_name)
+
+    existing_rows = []
+    if append:
+        with span("sheets.read"):
+            existing_rows = _sheets_call(sheet.get_all_values)
+    else:
+        with span("sheets.clear"):
+            _sheets_call(sheet.clear) # Clear the sheet before writing new data
+
+    existing_headers = existing_rows[0] if existing_rows else None
+    final_headers = _sheet_headers(data, existing_headers)
+
+    if existing_headers and "url" in existing_headers:
+        url_column = existing_headers.index("url")
+        known_urls = {row[url_column] for row in existing_rows[1:] if len(row) > url_column}
+        data = [item for item in data if str(item.get("url")) not in known_urls]
+        if not data:
+            print(f"[ℹ️] No new products to add: {spreadsheet.url}")
+            return
+
+    start_row = len(existing_rows) + 1 if existing_rows else 2
+    new_rows = _sheet_rows(data, final_headers)
+    _write_sheet_rows(sheet, final_headers, existing_headers, new_rows, start_row)
 
-    print(f"[✔] Google Sheet successfully updated/created: {spreadsheet.url}")
+    print(f"[✔] Google Sheet successfully updated/created ({len(new_rows)} rows): {spreadsheet.url}")
 
 
 # ------------------------
@@ -298,22 +926,20 @@ def export_to_gsheet(data, sheet_name="Shopping Results"):
 # ------------------------
 def save_preferences(category, preferences, note=None):
     """Saves user preferences by category."""
-    SAVED_PREFERENCES[category] = {
-        "preferences": preferences,
-        "timestamp": datetime.now().isoformat(),
-        "note": note or ""
-    }
-    with open(PREFERENCES_FILE, "w", encoding="utf-8") as f:
-        json.dump(SAVED_PREFERENCES, f, indent=2, ensure_ascii=False)
+    SAVED_PREFERENCES.put(category, preferences, timestamp=datetime.now().isoformat(), note=note or "")
     print(f"[✔] Preferences for '{category}' saved.")
 
 # ------------------------
 # Load Old Preferences (Story M2)
 # ------------------------
+def get_saved_preferences(category):
+    """Returns the saved {"preferences", "timestamp", "note"} record for a category, or None."""
+    return SAVED_PREFERENCES.get(category)
+
 def load_previous_preferences(category):
     """Loads saved preferences for a given category and asks the user."""
-    if category in SAVED_PREFERENCES:
-        data = SAVED_PREFERENCES[category]
+    data = get_saved_preferences(category)
+    if data is not None:
         print(f"\n🔁 Found saved preferences for '{category}':")
         print("Preferences:", json.dumps(data["preferences"], indent=2, ensure_ascii=False))
         if data["note"]:
@@ -330,15 +956,8 @@ def load_previous_preferences(category):
 # ------------------------
 # Workflow A: Targeted Search (User Knows What They Want)
 # ------------------------
-def targeted_search_workflow():
-    """Implements Workflow A: Targeted Search."""
-    category = input("Enter the product (e.g., kitchen composter, laptop): ").strip().lower()
-    
-    # Story A1: Describe a Clear Goal
-    print("Now specify the attributes that are important to you (e.g., electric:true, quietness:true, subscription_required:false).")
-    print("Enter one attribute at a time in 'key:value' format, or press Enter to finish.")
-    print("You can also enter general keywords without ':'.")
-    
+def read_filters():
+    """Reads 'key:value' attributes and plain keywords until an empty line; returns (keywords, attributes)."""
     attributes = {}
     keywords = []
     while True:
@@ -362,6 +981,26 @@ def targeted_search_workflow():
                 attributes[key] = value_str
         else:
             keywords.append(attr_input.lower())
+    return keywords, attributes
+
+def _print_facets(index):
+    facets = index.facets()
+    if facets:
+        print("Attributes found in the fetched products:")
+        for attr, values in facets.items():
+            print(f"  {attr}: " + ", ".join(f"{value} ({count})" for value, count in values.items()))
+
+@traced()
+def targeted_search_workflow():
+    """Implements Workflow A: Targeted Search."""
+    category = input("Enter the product (e.g., kitchen composter, laptop): ").strip().lower()
+    
+    # Story A1: Describe a Clear Goal
+    print("Now specify the attributes that are important to you (e.g., electric:true, quietness:true, subscription_required:false).")
+    print("Enter one attribute at a time in 'key:value' format, or press Enter to finish.")
+    print("You can also enter general keywords without ':'.")
+    with span("targeted.read_filters"): # User input: shows how much of a session is think time
+        keywords, attributes = read_filters()
 
     print(f"\nYou are searching for: {category}")
     if keywords:
@@ -370,45 +1009,52 @@ def targeted_search_workflow():
         print(f"With attributes: {attributes}")
 
     # Story A2: Agent Filters Products Based on Criteria (via Google Shopping)
-    results = search_google_products(category, keywords, attributes)
-
-    print("\n🔍 Found products:")
-    if results:
-        # Show only top 3-5, as specified in Story A3 details
-        for i, p in enumerate(results[:min(5, len(results))]): # Display max 5
-            print(f" {i+1}. {p['name']} | Price: {p['price']} | Store: {p['source']}\n    Link: {p['url']}")
-            if p['attributes']:
-                print(f"    Detected attributes: {p['attributes']}")
-        
-        # Story A3: Optional Spreadsheet Export
-        if len(results) > 5 or prompt_yes_no("More results found. Do you want to get the full list in Google Sheets for comparison or exploration?"):
-            export_to_gsheet(results, sheet_name=f"{category.replace(' ', '_')}_Targeted_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    # Story A3: Optional Spreadsheet Export
+    # Results are shown (top 3-5, as specified in Story A3 details) and exported while the search is still running
+    console = ConsoleSink("🔍 Found products:", limit=5) # Display max 5
+    export = SheetExportSink(
+        f"{category.replace(' ', '_')}_Targeted_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        auto_export_after=5,
+        confirm=lambda: prompt_yes_no("More results found. Do you want to get the full list in Google Sheets for comparison or exploration?"),
+    )
+    index = ResultIndex() # Every fetched product, also those the filters rejected
+    history = PriceHistorySink(search_key(category, keywords=keywords, attributes=attributes))
+    try:
+        with span("targeted.search", category=category) as fields:
+            found = run_pipeline(search_products_stream(category, keywords, attributes, index=index, status=history.status),
+                                 [console, export, history])
+            fields["products"] = found
+    except SerpApiError as e:
+        print_search_error(e)
     else:
-        print("❌ No products found matching your criteria. Try changing your query.")
-    
+        if not found:
+            print("❌ No products found matching your criteria. Try changing your query.")
+
+    # Refinement is answered from the index: no new SerpAPI call and no extraction
+    while len(index) and prompt_yes_no(f"Refine the filters on the {len(index)} fetched products (no new search)?"):
+        _print_facets(index)
+        print("Enter the complete new set of attributes and keywords.")
+        with span("targeted.read_filters"):
+            keywords, attributes = read_filters()
+        with span("targeted.refine", products=len(index)) as fields:
+            refined = index.filter(keywords, attributes)
+            fields["matches"] = len(refined)
+        run_pipeline(iter(refined), [ConsoleSink(f"🔍 {len(refined)} of {len(index)} fetched products match:", limit=5)])
+        if not refined:
+            print("❌ None of the fetched products match these filters.")
+        elif len(refined) > 5 and prompt_yes_no("Export these results to Google Sheets?"):
+            export_to_gsheet(refined, sheet_name=f"{category.replace(' ', '_')}_Targeted_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
     combined_preferences = {"keywords": keywords, "attributes": attributes}
     return category, combined_preferences # Return for saving in main
 
 # ------------------------
-# Workflow B: Exploratory Search (User Doesn't Know What Matters)
+# Exploratory Search Core (shared by the CLI and the HTTP service; never prompts)
 # ------------------------
-def exploratory_search_workflow():
-    """Implements Workflow B: Exploratory Search."""
-    # Story B1: Initial Exploration Prompt
-    category = input("Enter a general product need (e.g., composter, laptop): ").strip().lower()
-    print(f"\n🚀 Exploratory search for category: '{category}'")
-
-    # Story B2: Agent Explores the Domain
-    print("Agent is exploring the domain to understand what matters to buyers...")
-    
-    # Simulate web search and article summarization
-    major_features_summary = simulate_llm_summarize(category)
-    print(f"\nKey features to consider when choosing a {category}:\n{major_features_summary}")
-
-    # Simulate getting a list of attributes with approximate importance
-    suggested_attributes = {}
+def suggest_attributes(category):
+    """Simulates getting a list of attributes with approximate importance for a category."""
     if category == "laptop":
-        suggested_attributes = {
+        return {
             "cpu": "processor (overall performance)",
             "ram": "RAM (multitasking)",
             "storage": "storage (capacity and speed)",
@@ -420,7 +1066,7 @@ def exploratory_search_workflow():
             "price": "price"
         }
     elif "composter" in category:
-        suggested_attributes = {
+        return {
             "bin_size": "bin size (for waste volume)",
             "quietness": "quietness (if silence is important)",
             "cycle_time": "cycle time (processing speed)",
@@ -430,7 +1076,7 @@ def exploratory_search_workflow():
             "subscription_required": "subscription required"
         }
     elif category == "smartphone":
-         suggested_attributes = {
+        return {
             "camera": "camera (photo/video quality)",
             "processor": "processor (operating speed)",
             "screen_type": "screen type (AMOLED/LCD)",
@@ -440,50 +1086,89 @@ def exploratory_search_workflow():
             "5g_support": "5G support"
         }
     else: # General attributes if category not recognized
-        suggested_attributes = {
+        return {
             "price": "price",
             "quality": "build quality",
             "durability": "durability",
             "ease_of_use": "ease of use"
         }
 
+def describe_category(category):
+    """
+    Returns (summary, suggested_attributes) for a category.
+    Served from the category knowledge base; the model is only asked about categories it hasn't seen.
+    """
+    knowledge = category_knowledge().get(category)
+    return knowledge["summary"], knowledge["attributes"]
+
+def exploratory_search(category, user_priorities, top_k=5):
+    """
+    Finds the products that best match {attribute: rating} priorities for a category.
+    Returns (best_matches, all_found_products).
+    """
+    # Collect all products that might be relevant: a broad search by category plus one
+    # query variant per highly rated attribute, all issued concurrently
+    queries = [{"category": category}]
+    for attr, rating in sorted(user_priorities.items(), key=lambda item: item[1], reverse=True):
+        terms = attribute_query_terms(attr)
+        if rating >= 4 and terms and len(queries) < EXPLORATORY_MAX_QUERIES:
+            queries.append({"category": category, "query_suffix": terms})
+    with span("exploratory.fanout", queries=len(queries)) as fields:
+        all_found_products = search_google_products_fanout(queries)
+        fields["products"] = len(all_found_products)
+
+    # Weighted scoring: one vectorized pass over all products, partial selection of the top k
+    with span("exploratory.score", products=len(all_found_products)):
+        from scoring import score_products
+        best_matches = [p for score, p in score_products(all_found_products, user_priorities, top_k=top_k)]
+    return best_matches, all_found_products
+
+# ------------------------
+# Workflow B: Exploratory Search (User Doesn't Know What Matters)
+# ------------------------
+@traced()
+def exploratory_search_workflow():
+    """Implements Workflow B: Exploratory Search."""
+    # Story B1: Initial Exploration Prompt
+    category = input("Enter a general product need (e.g., composter, laptop): ").strip().lower()
+    print(f"\n🚀 Exploratory search for category: '{category}'")
+
+    # Story B2: Agent Explores the Domain
+    print("Agent is exploring the domain to understand what matters to buyers...")
+    
+    # Simulate web search and article summarization, plus a list of attributes with approximate importance
+    # (both are remembered per category, so exploring the same category again costs no model call)
+    with span("exploratory.describe_category", category=category):
+        major_features_summary, suggested_attributes = describe_category(category)
+    print(f"\nKey features to consider when choosing a {category}:\n{major_features_summary}")
+
     # Story B3: Ask User to Rank Their Priorities
     print("\nPlease rate the importance of the following attributes on a scale of 1 (not important) to 5 (very important):")
     user_priorities = {}
-    for attr, description in suggested_attributes.items():
-        while True:
-            try:
-                rating = int(input(f"Importance of '{description}' ({attr}): "))
-                if 1 <= rating <= 5:
-                    user_priorities[attr] = rating
-                    break
-                else:
-                    print("Please enter a number between 1 and 5.")
-            except ValueError:
-                print("Invalid input. Please enter a number.")
+    with span("exploratory.rate_priorities"): # User input
+        for attr, description in suggested_attributes.items():
+            while True:
+                try:
+                    rating = int(input(f"Importance of '{description}' ({attr}): "))
+                    if 1 <= rating <= 5:
+                        user_priorities[attr] = rating
+                        break
+                    else:
+                        print("Please enter a number between 1 and 5.")
+                except ValueError:
+                    print("Invalid input. Please enter a number.")
     
     print("\nYour priorities:", user_priorities)
 
     # Story B4: Return Best Matches Based on Learned Preferences
     print("\nSearching for the best matches based on your preferences...")
     
-    # Collect all products that might be relevant (broad search by category)
-    all_found_products = search_google_products(category)
-
-    # Simulate weighted scoring
-    scored_products = []
-    for product in all_found_products:
-        score = 0
-        product_attrs = simulate_llm_extract_features(product["name"], product.get("description", ""))
-        
-        for user_attr, user_rating in user_priorities.items():
-            if user_attr in product_attrs and product_attrs[user_attr] is not False and product_attrs[user_attr] is not None:
-                score += user_rating 
-        
-        scored_products.append((score, product))
-    
-    scored_products.sort(key=lambda x: x[0], reverse=True)
-    best_matches = [p for score, p in scored_products[:min(5, len(scored_products))]] # Display max 5
+    try:
+        best_matches, all_found_products = exploratory_search(category, user_priorities, top_k=5) # Display max 5
+    except SerpApiError as e:
+        print_search_error(e)
+        save_preferences(category, user_priorities)
+        return
 
     print("\n✨ Best matches:")
     if best_matches:
@@ -505,6 +1190,9 @@ def exploratory_search_workflow():
 # ------------------------
 def main():
     """Main function to run the Smart Shopping Concierge."""
+    load_env() # Before anything reads LOG_LEVEL, PROFILE_* or SERPAPI_CAPTURE_FILE
+    configure_logging()
+    configure_profiling() # No-op unless PROFILE_TRACE_FILE or PROFILE_CPROFILE_FILE is set
     print("\n🤖 Welcome to Smart Shopping Concierge!")
     print("I can help you find products in two ways:")
     print("  1. Targeted Search (you know what you want and what attributes are important).")
@@ -524,16 +1212,30 @@ def main():
                 keywords_from_saved = reused_preferences.get("keywords", [])
                 attributes_from_saved = reused_preferences.get("attributes", {})
                 
-                results = search_google_products(category_input_for_recall, keywords_from_saved, attributes_from_saved)
+                # Collects the results and reports new, repriced and vanished products since the last run
+                results = PriceHistorySink(search_key(category_input_for_recall, keywords=keywords_from_saved,
+                                                      attributes=attributes_from_saved))
+                try:
+                    run_pipeline(
+                        search_products_stream(category_input_for_recall, keywords_from_saved, attributes_from_saved,
+                                               status=results.status),
+                        [ConsoleSink("🔍 Products found with saved filters:", limit=5), results],
+                    )
+                except SerpApiError as e:
+                    print_search_error(e)
+                    continue
+                changes = results.changes
+                results = results.products
                 
                 if results:
-                    print("\n🔍 Products found with saved filters:")
-                    for i, p in enumerate(results[:min(5, len(results))]):
-                        print(f" {i+1}. {p['name']} | Price: {p['price']} | Store: {p['source']}\n    Link: {p['url']}")
-                        if p['attributes']:
-                            print(f"    Detected attributes: {p['attributes']}")
-                    if len(results) > 5 and prompt_yes_no("Export to Google Sheets?"):
-                        export_to_gsheet(results, sheet_name=f"{category_input_for_recall.replace(' ', '_')}_Recalled_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+                    sheet_name = f"{category_input_for_recall.replace(' ', '_')}_Recalled_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                    if changes is not None and changes.baseline is not None:
+                        # Only the delta is exported: new and repriced products
+                        changed = changes.new + [product for product, _, _ in changes.repriced]
+                        if changed and prompt_yes_no(f"Export the {len(changed)} new or repriced products to Google Sheets?"):
+                            export_to_gsheet(changed, sheet_name=sheet_name)
+                    elif len(results) > 5 and prompt_yes_no("Export to Google Sheets?"):
+                        export_to_gsheet(results, sheet_name=sheet_name)
                 else:
                     print("❌ No products found with saved filters. Perhaps the old criteria are too strict or the product is unavailable.")
                     if prompt_yes_no("Do you want to try a new targeted search for this category to update preferences?"):
@@ -549,6 +1251,8 @@ def main():
             exploratory_search_workflow()
         
         elif mode_choice == 'exit':
+            print(f"\n[ℹ️] {serp_cache().summary()}")
+            print(f"[ℹ️] {serpapi_client().summary()}")
             print("\n👋 Thank you for using Smart Shopping Concierge. Goodbye!")
             break
         else:
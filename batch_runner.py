@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import ShoppingConciarage as concierge
+from instrumentation import configure_logging, configure_profiling, log, percentile
+from price_history import search_key
+from result_set import ResultSet
+
+# ------------------------
+# Headless Batch Runner
+# ------------------------
+# Refreshes many saved searches without any prompting. Jobs come from a JSONL file
+# (one object per line) or straight from the saved preferences:
+#   {"category": "laptop", "keywords": ["16gb ram"], "attributes": {"gpu": "dedicated"}}   targeted
+#   {"category": "composter", "priorities": {"quietness": 5, "odor_control": 4}}         exploratory
+# Jobs run concurrently on a worker pool; all workers share one SerpAPI rate limit.
+# Results go to one file per search (JSON, or CSV/Parquet/Arrow IPC for analytics tools) and/or
+# to Google Sheets, and a latency and throughput report is printed at the end.
+# Every run is recorded in the price history; with --changes-only a job whose search ran
+# before writes and exports only its new and repriced products.
+#
+# Usage:
+#   python batch_runner.py --jobs jobs.jsonl --workers 8 --rate 5 --output-dir batch_results --format parquet
+#   python batch_runner.py --from-preferences --sheets --changes-only
+
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 5.0 # SerpAPI requests per second, shared by all workers
+DEFAULT_OUTPUT_DIR = "batch_results"
+TARGETED_KEYS = {"keywords", "attributes"}
+OUTPUT_FORMATS = {"json": ".json", "csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def load_jobs_file(path):
+    """Reads jobs from a JSONL file, skipping blank lines and '#' comments."""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})")
+            if not isinstance(job, dict) or not job.get("category"):
+                raise ValueError(f"{path}:{line_number}: every job needs a 'category'")
+            jobs.append(job)
+    return jobs
+
+def jobs_from_preferences():
+    """One job per saved category: targeted filters or exploratory priorities, whichever was saved."""
+    jobs = []
+    for category, record in concierge.SAVED_PREFERENCES.items():
+        preferences = record["preferences"]
+        if set(preferences) <= TARGETED_KEYS:
+            jobs.append({"category": category, "keywords": preferences.get("keywords", []),
+                         "attributes": preferences.get("attributes", {})})
+        else:
+            jobs.append({"category": category, "priorities": preferences})
+    return jobs
+
+def _slug(text):
+    return re.sub(r"[^\w-]+", "_", text.strip().lower()).strip("_") or "job"
+
+def _output_name(category, search):
+    """File name per search: jobs for one category with different filters don't overwrite each other."""
+    digest = hashlib.blake2b(search.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{_slug(category)}_{digest}"
+
+def write_results(path, fmt, job, finished, result):
+    """
+    JSON keeps the job and best matches; the columnar formats hold one row per product.
+    The file is written under a temporary name and then renamed, so a reader (or a duplicate
+    job writing the same search) never sees it half-written.
+    """
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    if fmt == "json":
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(job=job, finished=finished, **result), f, ensure_ascii=False)
+    else:
+        result_set = ResultSet.from_products(result["products"])
+        {"csv": result_set.to_csv, "parquet": result_set.to_parquet, "arrow": result_set.to_arrow_ipc}[fmt](tmp)
+    os.replace(tmp, path)
+
+def run_job(job, output_dir=None, sheets=False, fmt="json", changes_only=False):
+    """Runs one job and writes its results; returns a summary dict (never raises)."""
+    category = job["category"].strip().lower()
+    start = time.perf_counter()
+    summary = {"category": category, "kind": "exploratory" if "priorities" in job else "targeted"}
+    try:
+        if "priorities" in job:
+            best, products = concierge.exploratory_search(category, job["priorities"], top_k=job.get("top_k", 5))
+            result = {"best_matches": best, "products": products}
+            search = search_key(category, priorities=job["priorities"])
+            status = {"complete": False} # Each query stops at its target: never a full listing
+        else:
+            status = {}
+            products = list(concierge.search_products_stream(
+                category, job.get("keywords", []), job.get("attributes", {}),
+                max_pages=job.get("max_pages"), target=job.get("target"), status=status,
+            ))
+            result = {"products": products}
+            search = search_key(category, keywords=job.get("keywords", []), attributes=job.get("attributes", {}))
+        summary["products"] = len(products)
+
+        changes = concierge.PRICE_HISTORY.record(search, products, complete=status["complete"])
+        if changes.baseline is not None:
+            summary["changes"] = {"new": len(changes.new), "repriced": len(changes.repriced), "removed": len(changes.removed)}
+            result["changes"] = {
+                "since": datetime.fromtimestamp(changes.baseline).isoformat(timespec="seconds"),
+                "new": [p["id"] for p in changes.new],
+                "repriced": [{"id": p["id"], "old_price": old, "new_price": new} for p, old, new in changes.repriced],
+                "removed": changes.removed,
+            }
+            if changes_only:
+                products = result["products"] = changes.new + [p for p, _, _ in changes.repriced]
+
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if output_dir:
+            path = os.path.join(output_dir, _output_name(category, search) + OUTPUT_FORMATS[fmt])
+            write_results(path, fmt, job, stamp, result)
+            summary["file"] = path
+        if sheets and products:
+            sheet_name = f"{category.replace(' ', '_')}_Batch_Results_{stamp}"
+            concierge.export_to_gsheet(products, sheet_name=sheet_name)
+            summary["sheet"] = sheet_name
+        summary["ok"] = True
+    except Exception as e:
+        log.error("Job '%s' failed: %s", category, e)
+        summary["ok"] = False
+        summary["error"] = str(e)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+def run_batch(jobs, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, output_dir=DEFAULT_OUTPUT_DIR, sheets=False, fmt="json",
+              changes_only=False):
+    """Runs every job on a worker pool and returns (summaries, wall_seconds)."""
+    concierge.set_serpapi_rate_limit(rate)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    summaries = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = [pool.submit(run_job, job, output_dir, sheets, fmt, changes_only) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            summary = future.result()
+            summaries.append(summary)
+            status = "✔" if summary["ok"] else "ERROR"
+            changes = summary.get("changes")
+            delta = f", +{changes['new']} new, {changes['repriced']} repriced, -{changes['removed']}" if changes else ""
+            print(f"[{status}] {done}/{len(jobs)} {summary['category']} "
+                  f"({summary.get('products', 0)} products{delta}, {summary['seconds']:.2f}s)")
+    return summaries, time.perf_counter() - start
+
+def print_report(summaries, wall_seconds):
+    """Per-job latency percentiles and overall throughput."""
+    if not summaries:
+        print("[!] No jobs were run.")
+        return
+    latencies = [s["seconds"] for s in summaries]
+    failed = [s for s in summaries if not s["ok"]]
+    products = sum(s.get("products", 0) for s in summaries)
+    print("\n📊 Batch report")
+    print(f"  Jobs: {len(summaries)} ({len(failed)} failed) in {wall_seconds:.1f}s")
+    print(f"  Throughput: {len(summaries) / wall_seconds * 60:.1f} jobs/min, {products / wall_seconds:.1f} products/s")
+    print(f"  Job latency: p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s, "
+          f"max {max(latencies):.2f}s")
+    print(f"  {concierge.serp_cache().summary()}")
+    print(f"  {concierge.serpapi_client().summary()}")
+    for s in failed:
+        print(f"  [ERROR] {s['category']}: {s['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many saved searches headlessly.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--jobs", help="JSONL file with one job per line")
+    source.add_argument("--from-preferences", action="store_true", help="One job per saved category")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Max SerpAPI requests per second (all workers)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Directory for per-job JSON files ('' to skip)")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="json",
+                        help="Per-job file format (parquet and arrow need pyarrow)")
+    parser.add_argument("--changes-only", action="store_true",
+                        help="Write/export only products that are new or repriced since the job last ran")
+    parser.add_argument("--sheets", action="store_true", help="Also export each job's results to Google Sheets")
+    args = parser.parse_args()
+
+    concierge.load_env() # Before anything reads LOG_LEVEL, PROFILE_* or SERPAPI_CAPTURE_FILE
+    configure_logging()
+    configure_profiling()
+    try:
+        jobs = load_jobs_file(args.jobs) if args.jobs else jobs_from_preferences()
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(2)
+
+    summaries, wall_seconds = run_batch(jobs, args.workers, args.rate, args.output_dir or None,
+                                        args.sheets, args.format, args.changes_only)
+    print_report(summaries, wall_seconds)
+    sys.exit(1 if any(not s["ok"] for s in summaries) else 0)
+
+if __name__ == "__main__":
+    main()
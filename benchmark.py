@@ -0,0 +1,483 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import Counter
+
+import ShoppingConciarage as concierge
+from instrumentation import percentile, timing_log
+from serp_cache import SerpCache
+from serpapi_client import SerpApiClient
+
+# ------------------------
+# Offline Benchmark Suite
+# ------------------------
+# Measures search, feature extraction, exploratory scoring and Sheets export without any
+# live service. SerpAPI is replaced by a fake client transport that pages through a generated
+# corpus of shopping listings (English and Russian titles and snippets, the same product
+# at several stores), and Google Sheets by an in-memory backend that counts API calls.
+# For every corpus size and stage it reports throughput, latency percentiles and peak
+# memory, plus the per-page pipeline stages recorded by stage_timer.
+#
+# Usage:
+#   python benchmark.py [--sizes 10,1000,10000,100000] [--repeat 3] [--stages search,extract,score,export]
+#                       [--api-latency-ms 0] [--no-memory] [--json results.json]
+#                       [--baseline results.json --tolerance 0.2]
+# With --baseline, exits with code 1 if any stage's throughput dropped by more than `tolerance`.
+
+DEFAULT_SIZES = [10, 1000, 10000, 100000]
+STAGES = ["search", "search_all", "extract", "score", "export", "resultset"]
+BENCHMARK_PRIORITIES = {"price": 5, "gpu": 4, "ram": 4, "quietness": 3, "odor_control": 2}
+
+# ------------------------
+# Synthetic Product Corpus
+# ------------------------
+_BRANDS = ["Lenovo", "ASUS", "HP", "Dell", "Acer", "MSI", "Apple", "Huawei", "Xiaomi", "Samsung"]
+_STORES = ["Amazon.com", "Best Buy", "Walmart", "eBay", "Newegg", "Ozon", "Wildberries", "DNS", "М.Видео", "Ситилинк"]
+_CPUS = ["Intel i3", "Intel i5", "Intel i7", "Intel i9", "AMD Ryzen 5", "AMD Ryzen 7", "AMD Ryzen 9"]
+_GPUS = ["NVIDIA GeForce RTX 4060", "AMD Radeon RX 7600M", "Intel Iris Xe", "integrated graphics"]
+
+_TEMPLATES = {
+    "en": [
+        "{brand} {series} {size} inch Laptop {cpu} {ram}GB RAM {storage} SSD {gpu}",
+        "{brand} {series} Electric Kitchen Composter {volume}L Quiet Odor Control",
+        "{brand} {series} Smartphone {storage} 5G AMOLED {color}",
+        "{brand} {series} Wireless Portable Speaker Waterproof {color}",
+    ],
+    "ru": [
+        "Ноутбук {brand} {series} {size}\" {cpu} {ram}гб озу {storage} ssd встроенная графика",
+        "Электрический компостер {brand} {series} {volume}л бесшумный контроль запаха без подписки",
+        "Смартфон {brand} {series} {storage} 5G {color}",
+        "Беспроводной портативный динамик {brand} {series} водонепроницаемый {color}",
+    ],
+}
+_SNIPPETS = {
+    "en": [
+        "Free shipping. {storage} storage, {ram}GB memory, long battery life, full hd display.",
+        "Compact and durable design, large capacity, no subscription required.",
+        "Touchscreen, 4K UHD, fast charging, {color} aluminium body.",
+        "",
+    ],
+    "ru": [
+        "Бесплатная доставка. Накопитель {storage}, {ram}гб озу, долгая работа от батареи.",
+        "Компактный и долговечный корпус, большая емкость, без подписки.",
+        "Сенсорный экран, быстрая зарядка, цвет {color}.",
+        "",
+    ],
+}
+_COLORS = {"en": ["black", "silver", "blue", "white"], "ru": ["черный", "серебристый", "синий", "белый"]}
+
+
+def generate_listings(count, seed=0, russian_share=0.3, offers_per_product=3):
+    """
+    Generates `count` raw SerpAPI shopping_results entries.
+    Each product is listed by 1..offers_per_product stores at slightly different prices.
+    """
+    rng = random.Random(seed)
+    listings = []
+    product = 0
+    while len(listings) < count:
+        product += 1
+        lang = "ru" if rng.random() < russian_share else "en"
+        values = {
+            "brand": rng.choice(_BRANDS),
+            "series": f"X{product} {rng.choice('ABCDEFGH')}{rng.randint(100, 999)}", # Unique model per product
+            "size": rng.choice([13, 14, 15, 17]),
+            "cpu": rng.choice(_CPUS),
+            "ram": rng.choice([4, 8, 16, 32]),
+            "storage": rng.choice(["128GB", "256GB", "512GB", "1TB"]),
+            "gpu": rng.choice(_GPUS),
+            "volume": rng.choice([2, 3, 5, 10]),
+            "color": rng.choice(_COLORS[lang]),
+        }
+        title = rng.choice(_TEMPLATES[lang]).format(**values)
+        snippet = rng.choice(_SNIPPETS[lang]).format(**values)
+        base_price = round(rng.uniform(20, 3000), 2)
+        for store in rng.sample(_STORES, rng.randint(1, offers_per_product)):
+            if len(listings) >= count:
+                break
+            listings.append({
+                "position": len(listings) + 1,
+                "title": title,
+                "snippet": snippet,
+                "link": f"https://shop.example/{store.lower().replace(' ', '-')}/p{product}",
+                "source": store,
+                "extracted_price": round(base_price * rng.uniform(0.9, 1.1), 2),
+                "thumbnail": f"https://img.example/p{product}.jpg",
+            })
+    return listings
+
+# ------------------------
+# Fake Services
+# ------------------------
+class FakeSerpApi:
+    """Stand-in for the SerpAPI endpoint: a SerpApiClient transport paging through a fixed listing corpus."""
+
+    def __init__(self, listings, latency=0.0):
+        self.listings = listings
+        self.latency = latency
+        self.calls = 0
+
+    def transport(self, params, timeout):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        start = int(params.get("start", 0))
+        end = start + int(params.get("num", concierge.SERPAPI_PAGE_SIZE))
+        results = {"shopping_results": self.listings[start:end]}
+        if end < len(self.listings):
+            results["serpapi_pagination"] = {"next": f"start={end}"}
+        return 200, results
+
+
+class FakeWorksheet:
+    """In-memory worksheet implementing the calls export_to_gsheet makes."""
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.row_count = 1000
+        self.col_count = 26
+        self.rows = {}
+
+    def clear(self):
+        self.calls["clear"] += 1
+        self.rows = {}
+
+    def get_all_values(self):
+        self.calls["get_all_values"] += 1
+        if not self.rows:
+            return []
+        return [self.rows.get(r, []) for r in range(1, max(self.rows) + 1)]
+
+    def resize(self, rows=None, cols=None):
+        self.calls["resize"] += 1
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+    def batch_update(self, data):
+        self.calls["batch_update"] += 1
+        for update in data:
+            start = int(update["range"][1:])
+            for offset, row in enumerate(update["values"]):
+                self.rows[start + offset] = row
+                self.calls["cells_written"] += len(row)
+
+
+class FakeSpreadsheet:
+    def __init__(self, name, calls):
+        self.id = name
+        self.url = f"https://sheets.example/{name}"
+        self.sheet1 = FakeWorksheet(calls)
+
+
+class FakeSheetsClient:
+    """Replaces SheetsClientManager; counts every call that would reach the Sheets/Drive API."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.spreadsheets = {}
+
+    def open_or_create(self, sheet_name):
+        created = sheet_name not in self.spreadsheets
+        self.calls["create" if created else "open"] += 1
+        if created:
+            self.spreadsheets[sheet_name] = FakeSpreadsheet(sheet_name, self.calls)
+        return self.spreadsheets[sheet_name], created
+
+
+@contextlib.contextmanager
+def fake_services(listings, api_latency=0.0):
+    """Installs the fake SerpAPI, a throwaway response cache and the fake Sheets client."""
+    serpapi = FakeSerpApi(listings, api_latency)
+    sheets = FakeSheetsClient()
+    workdir = tempfile.mkdtemp(prefix="concierge-bench-")
+    caches = []
+
+    def reset():
+        # Every timed run starts from an empty cache, so each page is a real (fake) API call
+        caches.append(SerpCache(os.path.join(workdir, f"cache{len(caches)}.db"), max_entries=10 ** 6))
+
+    client = SerpApiClient(transport=serpapi.transport)
+    saved = concierge.serpapi_client, concierge.serp_cache, concierge.SHEETS_CLIENT
+    concierge.serpapi_client = lambda: client
+    concierge.serp_cache = lambda: caches[-1]
+    concierge.SHEETS_CLIENT = sheets
+    reset()
+    try:
+        yield types.SimpleNamespace(serpapi=serpapi, sheets=sheets, reset_cache=reset)
+    finally:
+        concierge.serpapi_client, concierge.serp_cache, concierge.SHEETS_CLIENT = saved
+        for cache in caches:
+            if cache._db is not None:
+                cache._db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# ------------------------
+# Measurement
+# ------------------------
+class TimingCollector(logging.Handler):
+    """Collects the structured records emitted by stage_timer / StageClock while attached."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.durations = {}
+
+    def emit(self, record):
+        stage = getattr(record, "stage", None)
+        if stage is not None:
+            self.durations.setdefault(stage, []).append(record.duration_ms)
+
+
+@contextlib.contextmanager
+def collect_timings():
+    collector = TimingCollector()
+    level, propagate = timing_log.level, timing_log.propagate
+    timing_log.addHandler(collector)
+    timing_log.setLevel(logging.INFO)
+    timing_log.propagate = False # Keep the records off the console
+    try:
+        yield collector.durations
+    finally:
+        timing_log.removeHandler(collector)
+        timing_log.setLevel(level)
+        timing_log.propagate = propagate
+
+def _latency_summary(latencies_ms):
+    if not latencies_ms:
+        return {}
+    return {
+        "p50_ms": round(percentile(latencies_ms, 0.50), 3),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 3),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 3),
+        "max_ms": round(max(latencies_ms), 3),
+    }
+
+def _peak_memory_mb(run):
+    """Peak traced allocation of one run, in MB (tracemalloc slows the run, so it is not timed)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    finally:
+        tracemalloc.stop()
+
+def measure(stage, size, units, run, repeat, memory=True):
+    """
+    Runs `run()` once to warm up (imports, regex compilation), then `repeat` more times, timed.
+    `run` returns a list of per-operation latencies in ms, or None to count the whole run as
+    one operation. Throughput is `units` per second.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    latencies, walls = [], []
+    with collect_timings() as substages:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # Export prints one line per sheet
+                operations = run()
+            wall = time.perf_counter() - start
+            walls.append(wall)
+            latencies.extend(operations if operations is not None else [wall * 1000])
+
+    result = {
+        "stage": stage,
+        "size": size,
+        "units": units,
+        "throughput": round(units / (sum(walls) / len(walls)), 1) if sum(walls) else None,
+        **_latency_summary(latencies),
+        "substages": {name: dict(count=len(d), **_latency_summary(d)) for name, d in sorted(substages.items())},
+    }
+    if memory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result["peak_mb"] = _peak_memory_mb(run)
+    return result
+
+# ------------------------
+# Stage Benchmarks
+# ------------------------
+def bench_search(size, listings, services, repeat, memory):
+    """The interactive path: search_google_products with default paging and early termination."""
+    def run():
+        services.reset_cache()
+        concierge.search_google_products("laptop")
+        return None
+    before = services.serpapi.calls
+    result = measure("search", size, min(size, concierge.SEARCH_MAX_PAGES * concierge.SERPAPI_PAGE_SIZE),
+                     run, repeat, memory)
+    result["api_calls"] = {"serpapi": round((services.serpapi.calls - before) / (1 + repeat + bool(memory)), 2)}
+    return result
+
+def bench_search_all(size, listings, services, repeat, memory):
+    """Full pipeline over every page of the corpus: fetch, parse/dedupe, extract, filter."""
+    pages = -(-size // concierge.SERPAPI_PAGE_SIZE)
+    products = []
+
+    def run():
+        services.reset_cache()
+        products[:] = concierge.search_products_stream("laptop", target=size + 1, max_pages=pages, time_budget=0)
+        return None
+    before = services.serpapi.calls
+    result = measure("search_all", size, size, run, repeat, memory)
+    result["api_calls"] = {"serpapi": round((services.serpapi.calls - before) / (1 + repeat + bool(memory)), 2)}
+    result["unique_products"] = len(products)
+    return result
+
+def bench_extract(size, listings, services, repeat, memory):
+    """Rule-based feature extraction in pipeline-sized batches; latency is per batch."""
+    items = [(p["title"], p["snippet"]) for p in listings]
+    batch_size = concierge.EXTRACT_BATCH_SIZE
+
+    def run():
+        latencies = []
+        for offset in range(0, len(items), batch_size):
+            start = time.perf_counter()
+            concierge.extract_features_batch(items[offset:offset + batch_size])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+    return measure("extract", size, size, run, repeat, memory)
+
+def _extracted_products(listings):
+    attributes = concierge.extract_features_batch([(p["title"], p["snippet"]) for p in listings])
+    return [
+        {"name": p["title"], "price": p["extracted_price"], "url": p["link"], "source": p["source"],
+         "image": p["thumbnail"], "attributes": a}
+        for p, a in zip(listings, attributes)
+    ]
+
+def bench_score(size, listings, services, repeat, memory):
+    """Exploratory scoring: one weighted top-k selection over the whole result set."""
+    from scoring import score_products
+
+    products = _extracted_products(listings)
+
+    def run():
+        score_products(products, BENCHMARK_PRIORITIES, top_k=5)
+        return None
+    return measure("score", size, size, run, repeat, memory)
+
+def bench_export(size, listings, services, repeat, memory):
+    """export_to_gsheet into the fake backend; api_calls counts requests per export."""
+    products = _extracted_products(listings)
+    runs = [0]
+
+    def run():
+        runs[0] += 1
+        concierge.export_to_gsheet(products, sheet_name=f"Benchmark_{size}_{runs[0]}")
+        return None
+    services.sheets.calls.clear()
+    result = measure("export", size, size, run, repeat, memory)
+    result["api_calls"] = {k: round(v / runs[0], 2) for k, v in services.sheets.calls.items()}
+    return result
+
+def bench_resultset(size, listings, services, repeat, memory):
+    """Building a columnar ResultSet; dicts_mb is the same products as loose dicts, for comparison."""
+    from result_set import ResultSet
+
+    products = _extracted_products(listings)
+
+    def run():
+        ResultSet.from_products(products)
+        return None
+    result = measure("resultset", size, size, run, repeat, memory)
+    if memory:
+        result["dicts_mb"] = _peak_memory_mb(lambda: [dict(p, attributes=dict(p["attributes"])) for p in products])
+    return result
+
+BENCHMARKS = {
+    "search": bench_search,
+    "search_all": bench_search_all,
+    "extract": bench_extract,
+    "score": bench_score,
+    "export": bench_export,
+    "resultset": bench_resultset,
+}
+
+def run_benchmarks(sizes, stages, repeat=3, memory=True, api_latency=0.0, seed=0):
+    results = []
+    for size in sizes:
+        listings = generate_listings(size, seed=seed)
+        with fake_services(listings, api_latency) as services:
+            for stage in stages:
+                result = BENCHMARKS[stage](size, listings, services, repeat, memory)
+                results.append(result)
+                print_result(result)
+    return results
+
+# ------------------------
+# Reporting
+# ------------------------
+def print_result(result):
+    calls = ", ".join(f"{k}={v:g}" for k, v in result.get("api_calls", {}).items())
+    if "dicts_mb" in result:
+        calls = f"(as dicts: {result['dicts_mb']:.2f} MB)"
+    print(f"{result['size']:>7} {result['stage']:<11} {result['throughput'] or 0:>12,.0f}/s "
+          f"{result.get('p50_ms', 0):>9.2f} {result.get('p95_ms', 0):>9.2f} {result.get('p99_ms', 0):>9.2f} "
+          f"{result.get('peak_mb', float('nan')):>8.2f}  {calls}")
+    for name, summary in result["substages"].items():
+        print(f"{'':>7}   {name:<9} {summary['count']:>10} ops "
+              f"{summary.get('p50_ms', 0):>9.2f} {summary.get('p95_ms', 0):>9.2f} {summary.get('p99_ms', 0):>9.2f}")
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Returns messages for every stage whose throughput fell more than `tolerance` below the baseline."""
+    previous = {(r["stage"], r["size"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["stage"], result["size"]))
+        if not old or not old.get("throughput") or not result.get("throughput"):
+            continue
+        change = result["throughput"] / old["throughput"] - 1
+        if change < -tolerance:
+            regressions.append(f"{result['stage']} @ {result['size']}: throughput {change:+.0%} "
+                               f"({old['throughput']:,.0f}/s -> {result['throughput']:,.0f}/s)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Smart Shopping Concierge.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Corpus sizes (listings)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Any of: {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="Simulated SerpAPI latency per page")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the (slower) peak memory pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop vs. the baseline")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    print(f"{'size':>7} {'stage':<11} {'throughput':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8}  api calls")
+    results = run_benchmarks(sizes, stages, args.repeat, not args.no_memory, args.api_latency_ms / 1000,
+                              args.seed)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[✔] Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            for message in regressions:
+                print(f"[ERROR] Regression: {message}")
+            sys.exit(1)
+        print("[✔] No throughput regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import difflib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("concierge")
+
+# ------------------------
+# Category Knowledge Base
+# ------------------------
+# Memoizes the per-category summary and suggested attributes, so a model is asked about
+# a category once and every later exploration of it is a dictionary lookup.
+# Category names are normalized ("Laptops" -> "laptop") and resolved to a known category
+# when they only add a qualifier ("kitchen composter" -> "composter") or contain a typo of a
+# built-in category ("labtop" -> "laptop"); resolved aliases are remembered too.
+# Typos are only matched against the built-in categories: among everything users have ever
+# explored, a one-letter difference is usually a different product ("house" vs "mouse").
+# Entries and aliases are stored in SQLite and expire after `ttl` seconds or when
+# KNOWLEDGE_VERSION changes (bump it whenever the prompts or the built-in knowledge change).
+
+KNOWLEDGE_VERSION = 1
+FUZZY_CUTOFF = 0.8 # Minimum difflib similarity for a typo match
+
+_NON_WORD_RE = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def _singular(token):
+    if len(token) <= 3 or not token.isascii():
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    if token.endswith(("ches", "shes", "xes", "sses")):
+        return token[:-2]
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def normalize_category(category):
+    """Lowercase, punctuation-free, singular form of a category name."""
+    tokens = _NON_WORD_RE.sub(" ", (category or "").lower()).split()
+    return " ".join(_singular(t) for t in tokens)
+
+
+class CategoryKnowledgeBase:
+    """
+    Persistent memo of {"summary", "attributes"} per category.
+    `generate(category)` returns (summary, attributes) and is only called on a miss.
+    """
+
+    def __init__(self, path, generate, ttl=30 * 86400, version=KNOWLEDGE_VERSION, known_categories=()):
+        self.path = path
+        self.generate = generate
+        self.ttl = ttl
+        self.version = version
+        self.known_categories = {normalize_category(c) for c in known_categories}
+        self.stats = {"hits": 0, "alias_hits": 0, "generated": 0}
+        self._entries = None # category -> entry, loaded from disk on first use
+        self._aliases = {} # normalized name -> {"category", "version", "created"}
+        self._db = None
+        self._lock = threading.Lock()
+        self._category_locks = {}
+
+    def _load(self):
+        # Called with self._lock held; reads the whole table once so every later lookup is O(1)
+        if self._entries is not None:
+            return
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS knowledge ("
+            "category TEXT PRIMARY KEY, summary TEXT NOT NULL, attributes TEXT NOT NULL, "
+            "version INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        if "version" not in {row[1] for row in db.execute("PRAGMA table_info(aliases)")}:
+            db.execute("DROP TABLE IF EXISTS aliases") # Aliases without a version can't expire; resolve them again
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS aliases ("
+            "alias TEXT PRIMARY KEY, category TEXT NOT NULL, version INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        db.commit()
+        self._db = db
+        self._entries = {
+            category: {"summary": summary, "attributes": json.loads(attributes), "version": version, "created": created}
+            for category, summary, attributes, version, created in db.execute(
+                "SELECT category, summary, attributes, version, created FROM knowledge")
+        }
+        self._aliases = {
+            alias: {"category": category, "version": version, "created": created}
+            for alias, category, version, created in db.execute("SELECT alias, category, version, created FROM aliases")
+        }
+
+    def _fresh(self, entry):
+        return entry is not None and entry["version"] == self.version and time.time() - entry["created"] < self.ttl
+
+    def _match(self, name):
+        """Known category that `name` refers to, or None."""
+        # "kitchen composter", "gaming laptop": a known category qualified by leading words
+        tokens = name.split()
+        suffixes = [c for c in self.known_categories | set(self._entries) if tokens[-len(c.split()):] == c.split()]
+        if suffixes:
+            return max(suffixes, key=len)
+        # "labtop", "smartphon": a typo of a built-in category, not a different word
+        # ("compost" is not a "composter", "tablet" is not a "table")
+        similar_length = [c for c in self.known_categories if abs(len(c) - len(name)) <= 1]
+        close = difflib.get_close_matches(name, similar_length, n=1, cutoff=FUZZY_CUTOFF)
+        return close[0] if close else None
+
+    def resolve(self, category):
+        """Canonical category for a user-entered name (the normalized name itself if nothing matches)."""
+        name = normalize_category(category)
+        with self._lock:
+            self._load()
+            if name in self._entries or name in self.known_categories or not name:
+                return name
+            alias = self._aliases.get(name)
+            if self._fresh(alias):
+                self.stats["alias_hits"] += 1
+                return alias["category"]
+            match = self._match(name)
+            if match is None or match == name:
+                return name
+            self._aliases[name] = {"category": match, "version": self.version, "created": time.time()}
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO aliases (alias, category, version, created) VALUES (?, ?, ?, ?)",
+                    (name, match, self.version, self._aliases[name]["created"]),
+                )
+            log.debug("Category '%s' resolved to '%s'", category, match)
+            return match
+
+    def _category_lock(self, category):
+        with self._lock:
+            return self._category_locks.setdefault(category, threading.Lock())
+
+    def get(self, category):
+        """
+        Returns {"category", "summary", "attributes"} for a category, generating it on a miss.
+        Concurrent requests for the same category share one generation.
+        """
+        canonical = self.resolve(category)
+        with self._category_lock(canonical):
+            with self._lock:
+                entry = self._entries.get(canonical)
+            if self._fresh(entry):
+                self.stats["hits"] += 1
+            else:
+                summary, attributes = self.generate(canonical)
+                entry = self.put(canonical, summary, attributes)
+                self.stats["generated"] += 1
+        return {"category": canonical, "summary": entry["summary"], "attributes": dict(entry["attributes"])}
+
+    def put(self, category, summary, attributes):
+        """Stores knowledge for a category (replacing any older version) and returns the entry."""
+        entry = {"summary": summary, "attributes": dict(attributes), "version": self.version, "created": time.time()}
+        with self._lock:
+            self._load()
+            self._entries[category] = entry
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO knowledge (category, summary, attributes, version, created) VALUES (?, ?, ?, ?, ?)",
+                    (category, summary, json.dumps(entry["attributes"], ensure_ascii=False), entry["version"], entry["created"]),
+                )
+        return entry
+
+    def invalidate(self, category=None):
+        """Forgets one category (or everything), so it is generated again on next use."""
+        with self._lock:
+            self._load()
+            with self._db:
+                if category is None:
+                    self._entries.clear()
+                    self._aliases.clear()
+                    self._db.execute("DELETE FROM knowledge")
+                    self._db.execute("DELETE FROM aliases")
+                else:
+                    self._entries.pop(category, None)
+                    for alias in [a for a, entry in self._aliases.items() if entry["category"] == category]:
+                        del self._aliases[alias]
+                    self._db.execute("DELETE FROM knowledge WHERE category = ?", (category,))
+                    self._db.execute("DELETE FROM aliases WHERE category = ?", (category,))
+
+    def summary(self):
+        s = self.stats
+        return f"Category knowledge: {s['hits']} hits, {s['alias_hits']} alias hits, {s['generated']} generated"
@@ -0,0 +1,101 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+# ------------------------
+# Import-Time Budget Check
+# ------------------------
+# Guards the time-to-menu of the CLI. Runs `python -X importtime -c "import ShoppingConciarage"`
+# in a fresh interpreter, prints the slowest imports, and fails (exit code 1) if:
+#   - importing the module takes longer than the budget,
+#   - any heavy dependency is imported eagerly, or
+#   - starting the CLI and reaching the menu takes longer than the menu budget.
+# Usage: python check_import_time.py [--budget-ms 150] [--menu-budget-ms 1000] [--top 10]
+
+MODULE = "ShoppingConciarage"
+HEAVY_MODULES = ["gspread", "oauth2client", "serpapi", "numpy", "dotenv", "requests", "google"]
+DEFAULT_BUDGET_MS = 150
+DEFAULT_MENU_BUDGET_MS = 1000
+MENU_PROMPT = "Select mode"
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module=MODULE):
+    """Returns a list of (cumulative_us, self_us, depth, name) for every module imported."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=here, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+    return entries
+
+def measure_time_to_menu():
+    """Wall-clock milliseconds from starting the CLI until the mode prompt is printed."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-u", f"{MODULE}.py"], cwd=here,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    elapsed = None
+    output = ""
+    while True:
+        char = proc.stdout.read(1)
+        if not char:
+            break
+        output += char
+        if output.endswith(MENU_PROMPT):
+            elapsed = (time.perf_counter() - start) * 1000
+            break
+    proc.communicate("exit\n", timeout=30)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the Smart Shopping Concierge.")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    parser.add_argument("--menu-budget-ms", type=float, default=float(os.getenv("MENU_TIME_BUDGET_MS", DEFAULT_MENU_BUDGET_MS)))
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    args = parser.parse_args()
+
+    entries = measure_imports()
+    total_ms = next(cum for cum, _, depth, name in entries if name == MODULE and depth == 0) / 1000
+
+    print(f"Slowest imports (cumulative) while importing {MODULE}:")
+    for cumulative_us, self_us, depth, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+
+    failures = []
+    eager = sorted({name for _, _, _, name in entries if name.split(".")[0] in HEAVY_MODULES})
+    if eager:
+        failures.append(f"heavy modules imported eagerly: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    menu_ms = measure_time_to_menu()
+    if menu_ms is None:
+        failures.append("the CLI never showed the menu")
+    else:
+        print(f"\nImport: {total_ms:.1f} ms, time to menu: {menu_ms:.1f} ms")
+        if menu_ms > args.menu_budget_ms:
+            failures.append(f"time to menu was {menu_ms:.1f} ms (budget {args.menu_budget_ms:.0f} ms)")
+
+    if failures:
+        for failure in failures:
+            print(f"[ERROR] {failure}")
+        sys.exit(1)
+    print("[✔] Startup is within budget.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, tracing
+from rate_limit import TokenBucket
+
+log = logging.getLogger("concierge")
+
+# ------------------------
+# Feature Extraction Backends
+# ------------------------
+# A backend turns a list of (title, snippet) pairs into a list of attribute dicts.
+#   RuleBasedBackend - the keyword matcher; fast and local.
+#   LLMBackend       - packs many products into one prompt, runs prompts concurrently under
+#                      a request and token rate limit, caches validated answers per
+#                      (model, prompt text and vocabulary, title, snippet) hash and falls
+#                      back to the rule-based backend for any product whose batch failed
+#                      or did not finish within the deadline.
+
+EXTRACTION_PROMPT_VERSION = 1 # Part of every cache key; bump when answers are parsed differently
+
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class RuleBasedBackend:
+    """Wraps a batch extractor function such as extract_features_batch."""
+
+    name = "rules"
+
+    def __init__(self, extract_batch):
+        self.extract_batch = extract_batch
+
+    def extract(self, items):
+        return self.extract_batch(items)
+
+
+class ExtractionCache:
+    """Validated attribute dicts per content hash, in memory and in SQLite."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0}
+        self._memory = {}
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None and self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, attributes TEXT NOT NULL)")
+            self._db.commit()
+        return self._db
+
+    def get_many(self, keys):
+        """Returns {key: attributes} for every cached key."""
+        with self._lock:
+            found = {k: self._memory[k] for k in keys if k in self._memory}
+            missing = [k for k in keys if k not in found]
+            db = self._connect()
+            if db is not None and missing:
+                for offset in range(0, len(missing), 500): # SQLite limits the number of parameters
+                    chunk = missing[offset:offset + 500]
+                    rows = db.execute(
+                        f"SELECT key, attributes FROM extractions WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                    for key, attributes in rows:
+                        found[key] = self._memory[key] = json.loads(attributes)
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(set(keys) - set(found))
+            return found
+
+    def put_many(self, entries):
+        with self._lock:
+            self._memory.update(entries)
+            db = self._connect()
+            if db is not None and entries:
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO extractions (key, attributes) VALUES (?, ?)",
+                        [(k, json.dumps(v, ensure_ascii=False)) for k, v in entries.items()],
+                    )
+
+
+class LLMBackend:
+    """
+    Batched, rate-limited model extraction with a result cache and a bounded deadline.
+    `model` needs a blocking generate_content(prompt) returning an object with a `.text`,
+    like google.generativeai.GenerativeModel.
+    `vocabulary` maps attribute -> allowed values; answers outside it are dropped, so model
+    and rule-based attributes can be filtered and scored the same way.
+    """
+
+    name = "llm"
+
+    def __init__(self, model, fallback, vocabulary=None, cache=None, batch_size=20, max_concurrency=4,
+                 requests_per_second=2.0, tokens_per_minute=250000, timeout=15.0, model_name="model"):
+        self.model = model
+        self.fallback = fallback
+        self.vocabulary = vocabulary
+        self.cache = cache or ExtractionCache()
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_second)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, burst=tokens_per_minute)
+        self.timeout = timeout
+        self.model_name = model_name
+        # The prompt without products is its fixed text plus the vocabulary: editing either
+        # changes every cache key, so stale answers are never reused
+        self.prompt_hash = hashlib.blake2b(self.build_prompt([]).encode("utf-8"), digest_size=8).hexdigest()
+        # Model calls run on this pool: a call that misses the deadline is abandoned without
+        # holding up the caller (asyncio.run would wait for threads of the default executor)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-extract")
+        self.stats = {"prompts": 0, "products": 0, "fallbacks": 0, "invalid": 0, "timeouts": 0}
+
+    def key(self, title, snippet):
+        text = f"{self.model_name}\x00{EXTRACTION_PROMPT_VERSION}\x00{self.prompt_hash}\x00{title or ''}\x00{snippet or ''}"
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def extract(self, items):
+        """Blocking entry point used by the pipeline; call it from a thread without a running event loop."""
+        return asyncio.run(self.extract_async(items))
+
+    async def extract_async(self, items):
+        if not items:
+            return []
+        keys = [self.key(title, snippet) for title, snippet in items]
+        results = self.cache.get_many(keys)
+
+        pending = {} # key -> item (identical products in one call are asked about once)
+        for key, item in zip(keys, items):
+            if key not in results:
+                pending.setdefault(key, item)
+        if pending:
+            pending_keys = list(pending)
+            batches = [pending_keys[i:i + self.batch_size] for i in range(0, len(pending_keys), self.batch_size)]
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            deadline = time.monotonic() + self.timeout
+            answers = await asyncio.gather(
+                *(self._run_batch([pending[k] for k in batch], semaphore, deadline) for batch in batches))
+
+            fresh = {}
+            for batch, answer in zip(batches, answers):
+                for key, attributes in zip(batch, answer or [None] * len(batch)):
+                    if attributes is not None:
+                        fresh[key] = attributes
+            self.cache.put_many(fresh)
+            results.update(fresh)
+
+            failed = [k for k in pending_keys if k not in fresh]
+            if failed:
+                self.stats["fallbacks"] += len(failed)
+                for key, attributes in zip(failed, self.fallback.extract([pending[k] for k in failed])):
+                    results[key] = attributes # Fallback answers are not cached; the model is asked again next time
+        return [dict(results[key]) for key in keys]
+
+    async def _run_batch(self, batch, semaphore, deadline):
+        """Returns one attribute dict (or None if unusable) per product, or None if the whole batch failed."""
+        prompt = self.build_prompt(batch)
+        try:
+            async with semaphore:
+                await self._acquire(self.requests, 1, deadline)
+                await self._acquire(self.tokens, min(len(prompt) // 4, self.tokens.capacity), deadline)
+                self.stats["prompts"] += 1
+                self.stats["products"] += len(batch)
+                count("api_calls.llm")
+                if tracing():
+                    count("api_bytes.llm", len(prompt.encode("utf-8")))
+                text = await asyncio.wait_for(self._generate(prompt), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            log.warning("Extraction batch of %d products timed out; using rule-based extraction", len(batch))
+            return None
+        except Exception as e:
+            log.warning("Extraction batch of %d products failed (%s); using rule-based extraction", len(batch), e)
+            return None
+        return self.parse_response(text, len(batch))
+
+    async def _acquire(self, bucket, tokens, deadline):
+        while not bucket.try_acquire(tokens):
+            wait = max(0.01, (tokens - bucket.tokens) / bucket.rate)
+            if time.monotonic() + wait > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(wait)
+
+    async def _generate(self, prompt):
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self._executor, self.model.generate_content, prompt)
+        return response.text
+
+    def build_prompt(self, batch):
+        products = [{"id": i, "title": title or "", "description": description or ""}
+                    for i, (title, description) in enumerate(batch)]
+        lines = [
+            "Extract key attributes of each product from its title and description.",
+            "Answer with only a JSON array containing one object per product: "
+            '{"id": <product id>, "attributes": {<attribute>: <value>}}.',
+            "Leave out attributes that are not stated.",
+        ]
+        if self.vocabulary:
+            lines.append("Use only these attributes and values: "
+                         + json.dumps(self.vocabulary, ensure_ascii=False, sort_keys=True))
+        lines.append("Products: " + json.dumps(products, ensure_ascii=False))
+        return "\n".join(lines)
+
+    def parse_response(self, text, count):
+        """Validates the model's JSON; products with a missing or malformed answer get None."""
+        try:
+            answer = json.loads(_JSON_FENCE_RE.sub("", (text or "").strip()))
+        except json.JSONDecodeError:
+            self.stats["invalid"] += count
+            return None
+        results = [None] * count
+        if not isinstance(answer, list):
+            self.stats["invalid"] += count
+            return None
+        for entry in answer:
+            if not isinstance(entry, dict) or not isinstance(entry.get("attributes"), dict):
+                continue
+            i = entry.get("id")
+            if isinstance(i, int) and 0 <= i < count:
+                results[i] = self._validated(entry["attributes"])
+        self.stats["invalid"] += results.count(None)
+        return results
+
+    def _validated(self, attributes):
+        clean = {}
+        for attr, value in attributes.items():
+            if not isinstance(attr, str) or not isinstance(value, (str, bool, int, float)):
+                continue
+            attr = attr.lower()
+            if isinstance(value, str):
+                value = value.lower()
+            if self.vocabulary is not None and value not in self.vocabulary.get(attr, ()):
+                continue
+            clean[attr] = value
+        return clean
+
+    def summary(self):
+        s = self.stats
+        return (f"LLM extraction: {s['prompts']} prompts for {s['products']} products, "
+                f"{self.cache.stats['hits']} cached, {s['fallbacks']} fell back to rules "
+                f"({s['timeouts']} timeouts, {s['invalid']} invalid answers)")
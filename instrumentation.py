@@ -0,0 +1,330 @@
+import atexit
+import base64
+import functools
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# ------------------------
+# Logging and Instrumentation
+# ------------------------
+# Everything goes through the "concierge" logger hierarchy:
+#   concierge         - debug/warning/error messages
+#   concierge.timing  - one structured record per pipeline stage (INFO)
+#   concierge.raw     - compressed raw SerpAPI responses (only when capture is enabled)
+# Configuration comes from the environment:
+#   LOG_LEVEL=DEBUG|INFO|WARNING (default WARNING), LOG_FORMAT=text|json,
+#   SERPAPI_CAPTURE_FILE=<path> to enable raw response capture,
+#   PROFILE_TRACE_FILE / PROFILE_CPROFILE_FILE to enable profiling (see Profiling below).
+
+log = logging.getLogger("concierge")
+timing_log = logging.getLogger("concierge.timing")
+raw_log = logging.getLogger("concierge.raw")
+raw_log.propagate = False # Raw payloads never reach the console
+
+RAW_CAPTURE_MAX_BYTES = 10 * 1024 * 1024
+RAW_CAPTURE_BACKUPS = 5
+
+_STANDARD_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra` fields passed to the logger."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_FIELDS:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Matches the CLI's "[LEVEL] message" style and appends structured fields as key=value."""
+
+    def format(self, record):
+        text = f"[{record.levelname}] {record.getMessage()}"
+        fields = [f"{k}={v}" for k, v in vars(record).items() if k not in _STANDARD_RECORD_FIELDS]
+        return f"{text} {' '.join(fields)}" if fields else text
+
+
+def configure_logging(level=None, fmt=None):
+    """Installs the console handler and, if SERPAPI_CAPTURE_FILE is set, the raw response capture."""
+    level = (level or os.getenv("LOG_LEVEL", "WARNING")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log.handlers[:] = [handler]
+    log.setLevel(level)
+    log.propagate = False
+
+    capture_file = os.getenv("SERPAPI_CAPTURE_FILE")
+    raw_log.handlers[:] = []
+    raw_log.setLevel(logging.INFO if capture_file else logging.CRITICAL + 1)
+    if capture_file:
+        capture = RotatingFileHandler(capture_file, maxBytes=RAW_CAPTURE_MAX_BYTES,
+                                      backupCount=RAW_CAPTURE_BACKUPS, encoding="utf-8")
+        capture.setFormatter(logging.Formatter("%(message)s"))
+        raw_log.addHandler(capture)
+
+
+def capture_raw_response(params, payload):
+    """
+    Writes a zlib-compressed, base64-encoded copy of a raw API response to the capture file.
+    Does nothing (and serializes nothing) unless capture is enabled.
+    """
+    if not raw_log.isEnabledFor(logging.INFO):
+        return
+    safe_params = {k: v for k, v in params.items() if k != "api_key"}
+    body = json.dumps({"params": safe_params, "response": payload}, ensure_ascii=False, separators=(",", ":"))
+    raw_log.info("%s", base64.b64encode(zlib.compress(body.encode("utf-8"))).decode("ascii"))
+
+def read_raw_capture(path):
+    """Decodes a capture file back into {"params", "response"} dicts."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(zlib.decompress(base64.b64decode(line)))
+
+
+@contextmanager
+def stage_timer(stage, **fields):
+    """
+    Times a block and emits a structured record on concierge.timing.
+    Extra fields can be added to the yielded dict inside the block.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        if _tracer is not None:
+            _tracer.complete(stage, start, dict(fields))
+        if timing_log.isEnabledFor(logging.INFO):
+            fields["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            timing_log.info("timing", extra=dict(stage=stage, **fields))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list, e.g. fraction=0.95 for p95."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class StageClock:
+    """Accumulates time spent in a stage across many small steps and reports it once."""
+
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.elapsed = 0.0
+
+    @contextmanager
+    def step(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def report(self, **fields):
+        if timing_log.isEnabledFor(logging.INFO):
+            record = dict(stage=self.stage, **self.fields, **fields, duration_ms=round(self.elapsed * 1000, 3))
+            timing_log.info("timing", extra=record)
+
+
+# ------------------------
+# Profiling (opt-in)
+# ------------------------
+#   PROFILE_TRACE_FILE=<path>     records spans and counters and writes them as a Chrome trace
+#                                 (chrome://tracing or ui.perfetto.dev) when the process exits.
+#   PROFILE_CPROFILE_FILE=<path>  runs cProfile on the main thread and writes pstats when the
+#                                 process exits (python -m pstats <path> to read it).
+# Both files are also written on demand, without stopping, on SIGUSR1 or dump_profiles().
+# Disabled, span() hands out one shared no-op context manager, a traced function costs one
+# global check before the direct call, and count() returns at once.
+
+TRACE_MAX_EVENTS = 200000 # Further events are dropped (and counted) to bound memory
+
+_tracer = None
+_profiler = None
+_profile_file = None
+_dump_registered = False
+
+
+class Tracer:
+    """Collects complete ("X") and counter ("C") events in Chrome trace format."""
+
+    def __init__(self, path, max_events=TRACE_MAX_EVENTS):
+        self.path = path
+        self.max_events = max_events
+        self.events = []
+        self.counters = {}
+        self.dropped = 0
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._threads = {}
+        # Reentrant: the SIGUSR1 handler runs to_chrome() on the main thread, possibly while
+        # that same thread is inside _add() or count() holding the lock
+        self._lock = threading.RLock()
+
+    def _add(self, event):
+        tid = threading.get_ident()
+        event["pid"], event["tid"] = self.pid, tid
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+    def _ts(self, moment):
+        return round((moment - self.origin) * 1e6, 1) # Microseconds since the tracer started
+
+    def complete(self, name, start, args=None):
+        """Records a span that began at `start` (a time.perf_counter() value) and ends now."""
+        end = time.perf_counter()
+        self._add({"name": name, "cat": name.split(".")[0], "ph": "X", "ts": self._ts(start),
+                   "dur": round((end - start) * 1e6, 1), "args": args or {}})
+
+    def count(self, name, value):
+        """Adds `value` to counter "group.field"; every group is drawn as one stacked counter track."""
+        group, _, field = name.partition(".")
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            values = {k.partition(".")[2] or k: v for k, v in self.counters.items() if k.partition(".")[0] == group}
+        self._add({"name": group, "ph": "C", "ts": self._ts(time.perf_counter()), "args": values})
+
+    def to_chrome(self):
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+            counters = dict(self.counters)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in threads.items()]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                "otherData": {"counters": counters, "dropped_events": self.dropped}}
+
+    def write(self, path=None):
+        path = path or self.path
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False, default=str)
+        os.replace(tmp, path) # Never leave a half-written trace behind
+        return path
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.complete(self.name, self.start, self.args)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return {} # Callers may add fields; they are simply discarded
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def tracing():
+    """True while spans and counters are being recorded (guards costly argument computation)."""
+    return _tracer is not None
+
+def span(name, **args):
+    """
+    Times a block as one span on the trace timeline. Fields can be added to the yielded dict
+    inside the block. Does nothing unless tracing is enabled.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(_tracer, name, args)
+
+def traced(name=None):
+    """Decorator: every call of the function becomes a span named `name` (default: the function name)."""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, value=1):
+    """Adds to a counter such as "serpapi.calls" or "sheets.bytes" while tracing is enabled."""
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+def configure_profiling(trace_file=None, cprofile_file=None):
+    """Starts tracing and/or cProfile if a file is given here or in the environment."""
+    global _tracer, _profiler, _profile_file, _dump_registered
+    trace_file = trace_file or os.getenv("PROFILE_TRACE_FILE")
+    cprofile_file = cprofile_file or os.getenv("PROFILE_CPROFILE_FILE")
+    if trace_file and _tracer is None:
+        _tracer = Tracer(trace_file)
+    if cprofile_file and _profiler is None:
+        import cProfile
+        _profile_file = cprofile_file
+        _profiler = cProfile.Profile()
+        _profiler.enable() # Profiles the calling thread; worker threads show up in the trace instead
+    if (_tracer or _profiler) and not _dump_registered:
+        _dump_registered = True
+        atexit.register(dump_profiles)
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: dump_profiles())
+
+def dump_profiles():
+    """Writes the trace and the cProfile stats collected so far; profiling continues. Returns the paths."""
+    written = []
+    if _tracer is not None:
+        try:
+            written.append(_tracer.write())
+        except OSError as e:
+            log.warning("Could not write trace file: %s", e)
+    if _profiler is not None:
+        try:
+            _profiler.dump_stats(_profile_file) # Stops the profiler to snapshot it
+            written.append(_profile_file)
+        except OSError as e:
+            log.warning("Could not write cProfile file: %s", e)
+        finally:
+            _profiler.enable()
+    for path in written:
+        log.info("Profile written to %s", path)
+    return written
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+log = logging.getLogger("concierge")
+
+# ------------------------
+# Preferences Store
+# ------------------------
+# One SQLite row per category, so saving a category rewrites only that row.
+# Writes are transactional (a crash never leaves a truncated file) and SQLite's
+# file locking keeps concurrent processes from losing each other's updates.
+# The database is opened on first use; an existing preferences.json is imported once.
+
+
+class PreferencesStore:
+    """Per-category keyed store for saved user preferences."""
+
+    def __init__(self, path, legacy_json=None, busy_timeout=10.0):
+        self.path = path
+        self.legacy_json = legacy_json
+        self.busy_timeout = busy_timeout
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL") # Readers don't block the writer
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS preferences ("
+                "category TEXT PRIMARY KEY, preferences TEXT NOT NULL, timestamp TEXT NOT NULL, note TEXT NOT NULL)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            db.commit()
+            self._db = db
+            self._import_legacy_json()
+        return self._db
+
+    def _import_legacy_json(self):
+        """
+        Copies categories from the old preferences.json that are not in the database yet.
+        Runs once per database: the import is recorded in `meta`, so deleted categories stay deleted.
+        """
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        if self._db.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_imported'").fetchone():
+            return
+        try:
+            with open(self.legacy_json, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning("Could not import %s: %s", self.legacy_json, e)
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO preferences (category, preferences, timestamp, note) VALUES (?, ?, ?, ?)",
+                [
+                    (category, json.dumps(data.get("preferences", {}), ensure_ascii=False),
+                     data.get("timestamp", ""), data.get("note", ""))
+                    for category, data in legacy.items()
+                ],
+            )
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_imported', ?)",
+                             (os.path.abspath(self.legacy_json),))
+
+    def get(self, category):
+        """Returns {"preferences", "timestamp", "note"} for a category, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT preferences, timestamp, note FROM preferences WHERE category = ?", (category,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"preferences": json.loads(row[0]), "timestamp": row[1], "note": row[2]}
+
+    def put(self, category, preferences, timestamp, note=""):
+        """Inserts or replaces the record of one category in a single transaction."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO preferences (category, preferences, timestamp, note) VALUES (?, ?, ?, ?)",
+                    (category, json.dumps(preferences, ensure_ascii=False), timestamp, note),
+                )
+
+    def delete(self, category):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM preferences WHERE category = ?", (category,))
+
+    def categories(self):
+        """All stored category names."""
+        with self._lock:
+            return [row[0] for row in self._connect().execute("SELECT category FROM preferences ORDER BY category")]
+
+    def items(self):
+        """Yields (category, record) for every stored category."""
+        for category in self.categories():
+            record = self.get(category)
+            if record is not None:
+                yield category, record
+
+    def __contains__(self, category):
+        return self.get(category) is not None
@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# ------------------------
+# Price History
+# ------------------------
+# Every recorded search is a "run". For each run we append one compact row per product
+# (canonical product ID, price, available), plus an "unavailable" row when a product from
+# the previous run of the same search is gone. Nothing is ever updated in place.
+# A run that stopped early (enough results, page or time limit) only proves what it saw:
+# products it didn't reach are carried over with their last price instead of marked gone.
+# A diff between two runs of a search lists only what changed: new products, products no
+# longer returned, and products whose price moved, so alerts and exports handle deltas.
+
+PriceDiff = namedtuple("PriceDiff", ["new", "removed", "repriced", "unchanged", "baseline"])
+# new: product dicts; removed: {"id", "name", "url", "source", "price"} of the last sighting;
+# repriced: (product, old_price, new_price); unchanged: count;
+# baseline: when the run compared against was recorded (None for the first run of a search)
+
+def search_key(category, **filters):
+    """Stable identity of a search: category plus its filters (keywords, attributes, priorities...)."""
+    normalized = {k: v for k, v in filters.items() if v}
+    return json.dumps([category.strip().lower(), normalized], sort_keys=True, ensure_ascii=False)
+
+def _price(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class PriceHistory:
+    """Append-only SQLite time series of product prices and availability per search."""
+
+    def __init__(self, path, busy_timeout=10.0, min_change=0.01):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.min_change = min_change # Smaller price differences are not reported as repriced
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "  run_id INTEGER PRIMARY KEY AUTOINCREMENT, search TEXT NOT NULL, recorded REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS runs_search ON runs (search, run_id);"
+                "CREATE TABLE IF NOT EXISTS observations ("
+                "  run_id INTEGER NOT NULL, product_id TEXT NOT NULL, price REAL, available INTEGER NOT NULL,"
+                "  PRIMARY KEY (run_id, product_id)) WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS observations_product ON observations (product_id, run_id);"
+                "CREATE TABLE IF NOT EXISTS products ("
+                "  product_id TEXT PRIMARY KEY, name TEXT, url TEXT, source TEXT, first_seen REAL NOT NULL);"
+            )
+            self._db = db
+        return self._db
+
+    def _runs(self, db, search, limit):
+        """[(run_id, recorded)] of the latest runs of a search, newest first."""
+        return db.execute(
+            "SELECT run_id, recorded FROM runs WHERE search = ? ORDER BY run_id DESC LIMIT ?", (search, limit)).fetchall()
+
+    def _available(self, db, run_id):
+        """product ID -> price for the products available in a run."""
+        if run_id is None:
+            return {}
+        return dict(db.execute(
+            "SELECT product_id, price FROM observations WHERE run_id = ? AND available = 1", (run_id,)))
+
+    def record(self, search, products, timestamp=None, complete=True):
+        """
+        Records the products one run of `search` returned and returns the PriceDiff against the
+        previous run (everything is "new" the first time). Products need the canonical "id".
+        `complete=False` means the search stopped before its last result page, so previous
+        products missing from `products` are not reported as removed.
+        """
+        timestamp = timestamp or time.time()
+        current = {p["id"]: p for p in products if p.get("id")}
+        with self._lock:
+            db = self._connect()
+            with db:
+                previous_runs = self._runs(db, search, 1)
+                baseline = previous_runs[0][1] if previous_runs else None
+                previous = self._available(db, previous_runs[0][0] if previous_runs else None)
+                run_id = db.execute("INSERT INTO runs (search, recorded) VALUES (?, ?)", (search, timestamp)).lastrowid
+                db.executemany(
+                    "INSERT OR REPLACE INTO observations (run_id, product_id, price, available) VALUES (?, ?, ?, 1)",
+                    [(run_id, pid, _price(p.get("price"))) for pid, p in current.items()],
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO observations (run_id, product_id, price, available) VALUES (?, ?, ?, ?)",
+                    [(run_id, pid, price, int(not complete)) for pid, price in previous.items() if pid not in current],
+                )
+                db.executemany(
+                    "INSERT OR IGNORE INTO products (product_id, name, url, source, first_seen) VALUES (?, ?, ?, ?, ?)",
+                    [(pid, p.get("name"), p.get("url"), p.get("source"), timestamp) for pid, p in current.items()],
+                )
+                if not complete:
+                    previous = {pid: price for pid, price in previous.items() if pid in current}
+                return self._diff(db, previous, current, baseline)
+
+    def diff(self, search):
+        """PriceDiff between the last two recorded runs of `search` (None if it ran fewer than twice)."""
+        with self._lock:
+            db = self._connect()
+            runs = self._runs(db, search, 2)
+            if len(runs) < 2:
+                return None
+            latest = self._available(db, runs[0][0])
+            current = {}
+            for pid, name, url, source in self._product_info(db, latest):
+                current[pid] = {"id": pid, "name": name, "url": url, "source": source, "price": latest[pid]}
+            return self._diff(db, self._available(db, runs[1][0]), current, runs[1][1])
+
+    def _product_info(self, db, product_ids):
+        ids = list(product_ids)
+        for offset in range(0, len(ids), 500): # SQLite limits the number of parameters
+            chunk = ids[offset:offset + 500]
+            yield from db.execute(
+                f"SELECT product_id, name, url, source FROM products WHERE product_id IN ({','.join('?' * len(chunk))})",
+                chunk)
+
+    def _diff(self, db, previous, current, baseline):
+        new, repriced, unchanged = [], [], 0
+        for pid, product in current.items():
+            if pid not in previous:
+                new.append(product)
+                continue
+            old_price, new_price = previous[pid], _price(product.get("price"))
+            if old_price is not None and new_price is not None and abs(new_price - old_price) >= self.min_change:
+                repriced.append((product, old_price, new_price))
+            else:
+                unchanged += 1
+        removed = [
+            {"id": pid, "name": name, "url": url, "source": source, "price": previous[pid]}
+            for pid, name, url, source in self._product_info(db, [pid for pid in previous if pid not in current])
+        ]
+        return PriceDiff(new, removed, repriced, unchanged, baseline)
+
+    def history(self, product_id):
+        """[(timestamp, price, available)] for one product across every search that returned it."""
+        with self._lock:
+            return [
+                (recorded, price, bool(available))
+                for recorded, price, available in self._connect().execute(
+                    "SELECT r.recorded, o.price, o.available FROM observations o JOIN runs r ON r.run_id = o.run_id "
+                    "WHERE o.product_id = ? ORDER BY o.run_id", (product_id,))
+            ]
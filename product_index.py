@@ -0,0 +1,146 @@
+import hashlib
+import re
+
+# ------------------------
+# Product Deduplication Index
+# ------------------------
+# The same product listed by several stores (or returned by overlapping queries)
+# is grouped into one canonical entry. Titles are reduced to a set of normalized
+# tokens; identical token sets share a canonical ID, and near-identical ones are
+# found through MinHash buckets and confirmed by Jaccard similarity.
+# Near-identical titles are only grouped when their spec tokens (every token with a digit:
+# "512gb", "13", "i7", "m2") are the same, so "256GB SSD" and "512GB SSD" stay two products.
+
+TITLE_STOPWORDS = {
+    "the", "a", "an", "and", "with", "for", "new",
+    "и", "с", "для", "новый",
+}
+MINHASH_PERMUTATIONS = 16
+MINHASH_BANDS = 4 # 4 bands of 4 rows: ~88% of pairs at Jaccard 0.8 become candidates, ~3% at 0.3
+NEAR_DUPLICATE_THRESHOLD = 0.8 # Minimum Jaccard similarity of title token sets
+
+_TOKEN_RE = re.compile(r"[\w\"]+", re.UNICODE)
+
+
+def title_tokens(title):
+    """Normalized token set of a product title."""
+    return frozenset(t for t in _TOKEN_RE.findall((title or "").lower()) if t not in TITLE_STOPWORDS)
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+def spec_tokens(tokens):
+    """Tokens carrying a number: capacities, sizes, model numbers."""
+    return frozenset(t for t in tokens if any(c.isdigit() for c in t))
+
+def canonical_id(tokens):
+    """Canonical product ID: a hash of the sorted title token set."""
+    return hashlib.blake2b(" ".join(sorted(tokens)).encode("utf-8"), digest_size=8).hexdigest()
+
+def offer_id(product):
+    """Identity of one store listing: its link, or title and store when there is no link."""
+    link = product.get("url")
+    if link:
+        return link
+    return f"{product.get('source')}|{' '.join(sorted(title_tokens(product.get('name'))))}"
+
+_MINHASH_SEEDS = [_hash(f"seed-{i}") for i in range(MINHASH_PERMUTATIONS)]
+
+def _minhash_bands(tokens):
+    token_hashes = [_hash(t) for t in tokens]
+    signature = [min((h ^ seed) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF for h in token_hashes)
+                 for seed in _MINHASH_SEEDS]
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(MINHASH_BANDS)]
+
+
+def _is_price(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ProductIndex:
+    """In-memory index of unique products with their offers, price range and stores."""
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._entries = {} # canonical ID -> grouped entry
+        self._by_offer = {} # offer ID -> canonical ID
+        self._buckets = {} # (spec tokens, MinHash band) -> canonical IDs
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _find_group(self, tokens):
+        cid = canonical_id(tokens)
+        if cid in self._entries:
+            return cid
+        best, best_score = None, self.threshold
+        spec = spec_tokens(tokens)
+        candidates = set()
+        for band in _minhash_bands(tokens):
+            candidates.update(self._buckets.get((spec, band), ()))
+        for candidate in candidates:
+            other = self._entries[candidate]["_tokens"]
+            score = len(tokens & other) / len(tokens | other)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def add(self, product):
+        """Adds one product dict and returns the canonical ID of the group it joined."""
+        oid = offer_id(product)
+        if oid in self._by_offer:
+            return self._by_offer[oid] # Same listing returned again by another query
+
+        tokens = title_tokens(product.get("name"))
+        # Listings without a usable title are never grouped with anything else
+        cid = self._find_group(tokens) if tokens else canonical_id({oid})
+        if cid is None:
+            cid = canonical_id(tokens)
+        if cid not in self._entries:
+            self._entries[cid] = {"_tokens": tokens, "offers": [], "attributes": {}}
+            if tokens:
+                spec = spec_tokens(tokens)
+                for band in _minhash_bands(tokens):
+                    self._buckets.setdefault((spec, band), set()).add(cid)
+
+        entry = self._entries[cid]
+        entry["offers"].append(product)
+        for key, value in product.get("attributes", {}).items():
+            entry["attributes"].setdefault(key, value)
+        self._by_offer[oid] = cid
+        return cid
+
+    def add_many(self, products):
+        for product in products:
+            self.add(product)
+        return self
+
+    def get(self, cid):
+        entry = self._entries.get(cid)
+        return self._summarize(cid, entry) if entry else None
+
+    def _summarize(self, cid, entry):
+        # An offer may itself be a summary (fan-out merges already grouped results):
+        # its stores, price_max and offer_count then stand for all the offers behind it
+        offers = entry["offers"]
+        priced = [o for o in offers if _is_price(o.get("price"))]
+        cheapest = min(priced, key=lambda o: o["price"]) if priced else offers[0]
+        stores = []
+        for o in offers:
+            for store in o.get("stores") or [o.get("source")]:
+                if store and store not in stores:
+                    stores.append(store)
+        highest = [o["price_max"] if _is_price(o.get("price_max")) else o["price"] for o in priced]
+
+        product = dict(cheapest) # The cheapest offer represents the group
+        product["id"] = cid
+        product["attributes"] = dict(entry["attributes"], **cheapest.get("attributes", {}))
+        product["price_max"] = max(highest) if highest else "N/A"
+        product["stores"] = stores # A list; exports join it into one cell
+        product["offer_count"] = sum(o.get("offer_count", 1) for o in offers)
+        return product
+
+    def products(self):
+        """Unique products in insertion order, each represented by its cheapest offer."""
+        return [self._summarize(cid, entry) for cid, entry in self._entries.items()]
@@ -0,0 +1,99 @@
+import re
+
+# ------------------------
+# Session Result Index
+# ------------------------
+# Holds every product fetched during a session, indexed by attribute -> value -> product IDs
+# and by the tokens of title and description. New attribute and keyword filters are answered
+# by intersecting those sets, so refining a search needs no API call, no extraction and no
+# scan over the products. Filters mean the same as in the search pipeline: attributes must
+# be equal, and every keyword must appear in the title or description.
+
+_TOKEN_RE = re.compile(r"[\w\"]+", re.UNICODE)
+
+
+def _tokens(text):
+    return set(_TOKEN_RE.findall((text or "").lower()))
+
+
+class ResultIndex:
+    """Inverted index over already-fetched products (each needs a unique "id")."""
+
+    def __init__(self, products=()):
+        self._products = {} # product ID -> product, in insertion order
+        self._position = {} # product ID -> insertion number, for ordering filter results
+        self._by_attribute = {} # attribute -> value -> product IDs
+        self._by_token = {} # token -> product IDs
+        for product in products:
+            self.add(product)
+
+    def __len__(self):
+        return len(self._products)
+
+    def add(self, product):
+        """Indexes a product; a product whose ID is already indexed is ignored."""
+        pid = product["id"]
+        if pid in self._products:
+            return
+        self._products[pid] = product
+        self._position[pid] = len(self._position)
+        for attr, value in product.get("attributes", {}).items():
+            self._by_attribute.setdefault(attr, {}).setdefault(value, set()).add(pid)
+        for token in _tokens(product.get("name")) | _tokens(product.get("description")):
+            self._by_token.setdefault(token, set()).add(pid)
+
+    def add_many(self, products):
+        for product in products:
+            self.add(product)
+        return self
+
+    def _keyword_ids(self, keyword):
+        """IDs of products whose title or description contains `keyword`."""
+        candidates = None
+        for token in _tokens(keyword):
+            ids = self._by_token.get(token)
+            if ids is None:
+                # Keywords match substrings ("lap" finds "laptop"): widen to every token containing it
+                ids = set()
+                for indexed, token_ids in self._by_token.items():
+                    if token in indexed:
+                        ids |= token_ids
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        if candidates is None:
+            return set(self._products)
+        # Confirm the whole phrase ("16gb ram", not "16gb ... ram") on the few remaining products
+        keyword = keyword.lower()
+        return {pid for pid in candidates
+                if keyword in (self._products[pid].get("name") or "").lower()
+                or keyword in (self._products[pid].get("description") or "").lower()}
+
+    def filter(self, keywords=(), attributes=None):
+        """Products matching every keyword and attribute, in the order they were fetched."""
+        ids = None
+        # Smallest attribute sets first, so the running intersection shrinks fast
+        attribute_sets = sorted(
+            (self._by_attribute.get(attr, {}).get(value, set()) for attr, value in (attributes or {}).items()),
+            key=len,
+        )
+        for matching in attribute_sets:
+            ids = set(matching) if ids is None else ids & matching
+            if not ids:
+                return []
+        for keyword in keywords:
+            matching = self._keyword_ids(keyword)
+            ids = matching if ids is None else ids & matching
+            if not ids:
+                return []
+        if ids is None:
+            return list(self._products.values())
+        return [self._products[pid] for pid in sorted(ids, key=self._position.__getitem__)]
+
+    def facets(self):
+        """attribute -> {value: number of products}, to show which refinements are possible."""
+        return {attr: {value: len(ids) for value, ids in values.items()}
+                for attr, values in sorted(self._by_attribute.items())}
+
+    def products(self):
+        return list(self._products.values())
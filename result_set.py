@@ -0,0 +1,248 @@
+import csv
+import math
+import sys
+from array import array
+
+# ------------------------
+# Compact Product Records and Columnar Result Sets
+# ------------------------
+# ProductRecord is a fixed-layout product (no per-instance __dict__) with the price as a float.
+# ResultSet stores many products column by column:
+#   - prices in contiguous float64 arrays (NaN where the price is unknown),
+#   - stores and every attribute dictionary-encoded: each distinct value is kept once
+#     (strings interned) and rows hold int32 codes, -1 meaning "not present".
+# A product's stores are a list; the column keeps them as a tuple and CSV, Parquet and Arrow
+# export write them as one "Store A, Store B" string.
+# Numeric columns are handed to Arrow without copying; Parquet and Arrow IPC export need
+# pyarrow (imported on first use), CSV export needs nothing extra.
+
+RECORD_COLUMNS = ["id", "name", "price", "price_max", "url", "source", "stores", "image", "offer_count"]
+
+
+def _float(value):
+    """Price as a float; "N/A", None and other non-numbers become NaN."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return math.nan
+
+def _stores(product):
+    """A product's stores as a tuple (the listing's own source when it has none)."""
+    stores = product.get("stores")
+    if stores:
+        return tuple(stores)
+    return (product["source"],) if product.get("source") else None
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Parquet/Arrow export needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+class ProductRecord:
+    """One product with a fixed set of fields; attributes stay a small dict."""
+
+    __slots__ = RECORD_COLUMNS + ["attributes"]
+
+    def __init__(self, id=None, name="", price=math.nan, price_max=math.nan, url=None, source=None,
+                 stores=(), image=None, offer_count=1, attributes=None):
+        self.id = id
+        self.name = name
+        self.price = _float(price)
+        self.price_max = _float(price_max)
+        self.url = url
+        self.source = source
+        self.stores = tuple(stores or ())
+        self.image = image
+        self.offer_count = offer_count
+        self.attributes = attributes or {}
+
+    @classmethod
+    def from_dict(cls, product):
+        return cls(**{field: product[field] for field in cls.__slots__ if field in product})
+
+    def to_dict(self):
+        """The loose dict form used by the pipeline and Sheets export ("N/A" for unknown prices)."""
+        product = {field: getattr(self, field) for field in self.__slots__}
+        for field in ("price", "price_max"):
+            if math.isnan(product[field]):
+                product[field] = "N/A"
+        product["stores"] = list(self.stores)
+        product["attributes"] = dict(self.attributes)
+        return product
+
+    def __repr__(self):
+        return f"ProductRecord({self.name!r}, price={self.price})"
+
+
+class DictionaryColumn:
+    """Dictionary-encoded column: distinct values stored once, one int32 code per row (-1 = missing)."""
+
+    __slots__ = ("values", "codes", "_lookup")
+
+    def __init__(self, length=0):
+        self.values = []
+        self.codes = array("i", [-1]) * length
+        self._lookup = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        key = (type(value), value) # Keeps True and 1 apart
+        code = self._lookup.get(key)
+        if code is None:
+            code = self._lookup[key] = len(self.values)
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        self.codes.append(code)
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        return None if code < 0 else self.values[code]
+
+
+class ResultSet:
+    """Columnar container for a search result; append product dicts or ProductRecords."""
+
+    def __init__(self):
+        self.ids = []
+        self.names = []
+        self.urls = []
+        self.images = []
+        self.prices = array("d")
+        self.price_max = array("d")
+        self.offer_counts = array("i")
+        self.sources = DictionaryColumn()
+        self.stores = DictionaryColumn()
+        self.attributes = {} # attribute -> DictionaryColumn
+
+    @classmethod
+    def from_products(cls, products):
+        result_set = cls()
+        for product in products:
+            result_set.append(product)
+        return result_set
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, product):
+        if isinstance(product, ProductRecord):
+            product = {field: getattr(product, field) for field in ProductRecord.__slots__}
+        row = len(self.ids)
+        self.ids.append(product.get("id"))
+        self.names.append(product.get("name") or "")
+        self.urls.append(product.get("url"))
+        self.images.append(product.get("image"))
+        self.prices.append(_float(product.get("price")))
+        self.price_max.append(_float(product.get("price_max", product.get("price"))))
+        self.offer_counts.append(product.get("offer_count", 1))
+        self.sources.append(product.get("source"))
+        self.stores.append(_stores(product))
+
+        attributes = product.get("attributes") or {}
+        for attr in attributes:
+            if attr not in self.attributes:
+                self.attributes[attr] = DictionaryColumn(row) # Earlier rows don't have it
+        for attr, column in self.attributes.items():
+            column.append(attributes.get(attr))
+
+    def __getitem__(self, row):
+        attributes = {}
+        for attr, column in self.attributes.items():
+            value = column[row]
+            if value is not None:
+                attributes[attr] = value
+        return ProductRecord(
+            id=self.ids[row], name=self.names[row], price=self.prices[row], price_max=self.price_max[row],
+            url=self.urls[row], source=self.sources[row], stores=self.stores[row], image=self.images[row],
+            offer_count=self.offer_counts[row], attributes=attributes,
+        )
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def to_dicts(self):
+        """Products as loose dicts, e.g. for export_to_gsheet."""
+        return [record.to_dict() for record in self]
+
+    # ------------------------
+    # Export
+    # ------------------------
+    def headers(self):
+        return RECORD_COLUMNS + sorted(self.attributes)
+
+    def to_csv(self, path):
+        """Writes one row per product (base columns, then one column per attribute)."""
+        attributes = sorted(self.attributes)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.headers())
+            for row in range(len(self)):
+                price, price_max = self.prices[row], self.price_max[row]
+                writer.writerow(
+                    [self.ids[row], self.names[row], "" if math.isnan(price) else price,
+                     "" if math.isnan(price_max) else price_max, self.urls[row], self.sources[row],
+                     ", ".join(self.stores[row] or ()), self.images[row], self.offer_counts[row]]
+                    + ["" if self.attributes[a][row] is None else self.attributes[a][row] for a in attributes]
+                )
+        return path
+
+    def to_arrow(self):
+        """
+        Arrow table of the result set; unknown prices are nulls. Price and offer count columns
+        share memory with this ResultSet, so no more products can be appended while the table is alive.
+        """
+        pa = _pyarrow()
+        import numpy as np
+
+        def numeric(values, arrow_type):
+            validity = None
+            if arrow_type == pa.float64():
+                # Unknown prices (NaN) become nulls through a validity bitmap; the values stay zero-copy
+                missing = np.isnan(np.frombuffer(values, dtype=np.float64))
+                if missing.any():
+                    validity = pa.py_buffer(np.packbits(~missing, bitorder="little"))
+            return pa.Array.from_buffers(arrow_type, len(values), [validity, pa.py_buffer(values)])
+
+        def dictionary(column, values=None):
+            codes = np.frombuffer(column.codes, dtype=np.int32)
+            indices = pa.array(codes, mask=codes < 0)
+            try:
+                values = pa.array(column.values if values is None else values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError): # Mixed value types in one attribute
+                values = pa.array([str(v) for v in column.values])
+            return pa.DictionaryArray.from_arrays(indices, values)
+
+        columns = {
+            "id": pa.array(self.ids, type=pa.string()),
+            "name": pa.array(self.names, type=pa.string()),
+            "price": numeric(self.prices, pa.float64()),
+            "price_max": numeric(self.price_max, pa.float64()),
+            "url": pa.array(self.urls, type=pa.string()),
+            "source": dictionary(self.sources),
+            "stores": dictionary(self.stores, [", ".join(stores) for stores in self.stores.values]),
+            "image": pa.array(self.images, type=pa.string()),
+            "offer_count": numeric(self.offer_counts, pa.int32()),
+        }
+        for attr in sorted(self.attributes):
+            columns[attr if attr not in columns else f"attr_{attr}"] = dictionary(self.attributes[attr])
+        return pa.table(columns)
+
+    def to_parquet(self, path):
+        _pyarrow()
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), path)
+        return path
+
+    def to_arrow_ipc(self, path):
+        """Writes an Arrow IPC (Feather v2) file."""
+        pa = _pyarrow()
+        table = self.to_arrow()
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return path
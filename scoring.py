@@ -0,0 +1,88 @@
+import re
+
+import numpy as np
+
+# ------------------------
+# Vectorized Preference Scoring
+# ------------------------
+# Products are encoded once into a feature matrix (one column per prioritized
+# attribute) and user ratings into a weight vector, so scoring is a single
+# matrix-vector product. Boolean/categorical attributes score 1 when present and
+# truthy; numeric attributes are min-max normalized to [0, 1] across the candidates.
+
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(gb|tb)")
+
+def _size_in_gb(value):
+    match = _SIZE_RE.search(str(value))
+    if not match:
+        return None
+    amount = float(match.group(1))
+    return amount * 1024 if match.group(2) == "tb" else amount
+
+def _price(product):
+    price = product.get("price")
+    return float(price) if isinstance(price, (int, float)) and not isinstance(price, bool) else None
+
+# attribute -> (value getter, higher_is_better)
+NUMERIC_ATTRIBUTES = {
+    "price": (_price, False),
+    "ram": (lambda p: _size_in_gb(p["attributes"].get("ram", "")), True),
+    "storage": (lambda p: _size_in_gb(p["attributes"].get("storage", "")), True),
+}
+
+
+def encode_products(products, attributes):
+    """Builds the (products x attributes) feature matrix for the given attribute order."""
+    columns = {attr: j for j, attr in enumerate(attributes)}
+    features = np.zeros((len(products), len(attributes)), dtype=np.float64)
+
+    # Presence features: one pass over the attributes each product actually has
+    for i, product in enumerate(products):
+        for attr, value in product.get("attributes", {}).items():
+            j = columns.get(attr)
+            if j is not None and attr not in NUMERIC_ATTRIBUTES and value is not False and value is not None:
+                features[i, j] = 1.0
+
+    # Numeric features: min-max normalized, missing values score 0
+    for attr, j in columns.items():
+        if attr not in NUMERIC_ATTRIBUTES:
+            continue
+        getter, higher_is_better = NUMERIC_ATTRIBUTES[attr]
+        raw = np.array([getter(p) for p in products], dtype=np.float64) # None becomes NaN
+        known = ~np.isnan(raw)
+        if not known.any():
+            continue
+        low, high = raw[known].min(), raw[known].max()
+        if high > low:
+            normalized = (raw - low) / (high - low)
+            if not higher_is_better:
+                normalized = 1.0 - normalized
+        else:
+            normalized = np.ones_like(raw)
+        features[:, j] = np.where(known, normalized, 0.0)
+
+    return features
+
+def score_products(products, priorities, top_k=5):
+    """
+    Scores products against {attribute: rating} priorities.
+    Returns the best `top_k` as (score, product) pairs, highest score first;
+    ties keep the original result order.
+    """
+    if not products:
+        return []
+    attributes = list(priorities)
+    weights = np.array([priorities[a] for a in attributes], dtype=np.float64)
+    scores = encode_products(products, attributes) @ weights
+
+    k = min(top_k, len(products))
+    if k < len(products):
+        # Partial selection instead of a full sort; ties at the cut-off go to the earliest products
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(len(products))
+    order = candidates[np.lexsort((candidates, -scores[candidates]))]
+    return [(float(scores[i]), products[i]) for i in order]
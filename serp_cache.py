@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("concierge")
+
+# ------------------------
+# SerpAPI Response Cache
+# ------------------------
+# Two tiers: a small in-memory LRU in front of an SQLite file on disk.
+# Entries younger than `ttl` are fresh. Entries older than that but within
+# `stale_ttl` are served immediately while a background thread refreshes them.
+
+def cache_key(params):
+    """Normalized cache key for SerpAPI query params (api_key is never part of the key)."""
+    normalized = {}
+    for key, value in params.items():
+        if key == "api_key" or value is None:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.lower().split())
+        normalized[key] = value
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+class SerpCache:
+    """Persistent, TTL-bounded cache for raw SerpAPI responses."""
+
+    def __init__(self, path, ttl=6 * 3600, stale_ttl=24 * 3600, max_entries=500, memory_entries=64):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+        self._memory = OrderedDict() # key -> (created, payload)
+        self._lock = threading.RLock()
+        self._refreshing = set()
+        self._db = None
+
+    def _connect(self):
+        # The database is opened on first use, not at import time
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key, created, payload):
+        self._memory[key] = (created, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        """Returns (created, payload) from memory or disk, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            db = self._connect()
+            row = db.execute("SELECT created, payload FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            created, payload = row[0], json.loads(row[1])
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+            self._remember(key, created, payload)
+            return created, payload
+
+    def put(self, key, payload):
+        """Stores a response and evicts the least recently used entries above max_entries."""
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            count = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                evicted = [row[0] for row in db.execute(
+                    "SELECT key FROM responses ORDER BY accessed ASC LIMIT ?", (excess,)
+                )]
+                db.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k in evicted])
+                for k in evicted:
+                    self._memory.pop(k, None)
+                self.stats["evictions"] += len(evicted)
+            db.commit()
+            self._remember(key, now, payload)
+
+    def _refresh(self, key, fetch):
+        try:
+            payload = fetch()
+            if "error" not in payload:
+                self.put(key, payload)
+                with self._lock:
+                    self.stats["refreshes"] += 1
+        except Exception as e:
+            log.warning("Background cache refresh failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, params, fetch):
+        """
+        Returns the cached response for `params`, calling `fetch()` on a miss.
+        Stale entries are returned as-is and refreshed in the background.
+        """
+        key = cache_key(params)
+        entry = self._lookup(key)
+        if entry is not None:
+            created, payload = entry
+            age = time.time() - created
+            if age <= self.ttl:
+                with self._lock:
+                    self.stats["hits"] += 1
+                return payload
+            if age <= self.ttl + self.stale_ttl:
+                with self._lock:
+                    self.stats["stale_hits"] += 1
+                    start_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if start_refresh:
+                    threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+                return payload
+
+        with self._lock:
+            self.stats["misses"] += 1
+        payload = fetch()
+        if "error" not in payload: # Don't cache SerpAPI error responses
+            self.put(key, payload)
+        return payload
+
+    def clear(self):
+        """Removes every cached response."""
+        with self._lock:
+            self._memory.clear()
+            if os.path.exists(self.path):
+                db = self._connect()
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def summary(self):
+        """One-line hit/miss summary for the CLI."""
+        s = self.stats
+        lookups = s["hits"] + s["stale_hits"] + s["misses"]
+        hit_rate = (s["hits"] + s["stale_hits"]) / lookups * 100 if lookups else 0.0
+        return (f"Search cache: {s['hits']} hits, {s['stale_hits']} stale hits, {s['misses']} misses "
+                f"({hit_rate:.0f}% hit rate), {s['refreshes']} background refreshes, {s['evictions']} evictions")
@@ -0,0 +1,318 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from instrumentation import count, percentile
+from rate_limit import TokenBucket
+
+log = logging.getLogger("concierge")
+
+# ------------------------
+# SerpAPI Client
+# ------------------------
+# Every SerpAPI search goes through one SerpApiClient per process:
+#   - one pooled keep-alive requests.Session, so searches reuse their TLS connections,
+#   - a deadline per call; each attempt's timeout is whatever is left of it,
+#   - up to `max_retries` retries of timeouts, connection errors, 429 and 5xx answers,
+#     with exponential backoff and full jitter (so parallel workers don't retry in lockstep),
+#   - a circuit breaker: after `failure_threshold` consecutive failed calls, calls fail at
+#     once for `cooldown` seconds, then a single trial call decides whether to close it again,
+#   - an optional token-bucket quota guard; a call that can't get a token before its
+#     deadline fails instead of queueing behind everyone else.
+# Failures raise SerpApiError, so callers can tell "SerpAPI is failing" from "no products".
+# A search Google has no results for is not an error: its payload has no shopping_results.
+
+SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
+LATENCY_WINDOW = 1000 # Most recent calls used for the latency percentiles
+
+_NO_RESULTS = "hasn't returned any results"
+
+
+class SerpApiError(Exception):
+    """
+    A SerpAPI search failed. `transient` errors (timeouts, connection errors, 429, 5xx) may go away
+    on their own; `retry_after` is a hint in seconds when trying again later may help.
+    """
+
+    transient = False
+    retry_after = None
+
+
+class SerpApiTimeout(SerpApiError):
+    """No answer before the call's deadline."""
+
+    transient = True
+
+
+class SerpApiUnavailable(SerpApiError):
+    """The circuit breaker is open after repeated failures."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SerpApiQuotaExceeded(SerpApiError):
+    """The local quota guard had no token for this call before its deadline."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _RetryableError(Exception):
+    """One attempt failed in a way that another attempt may fix."""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open after `cooldown` seconds."""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0.0
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns 0 if a call may go ahead, else the seconds until the breaker lets one through."""
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            remaining = self.opened + self.cooldown - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open" # Let exactly one trial call through
+                return 0
+            return max(remaining, 1.0)
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.state, self.failures = "closed", 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                    log.warning("SerpAPI circuit breaker opened after %d failures; pausing searches for %.0fs",
+                                self.failures, self.cooldown)
+                self.state, self.opened = "open", time.monotonic()
+
+    def release(self):
+        """A call let through while half-open never reached SerpAPI; let the next one try."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+
+class SerpApiClient:
+    """
+    Resilient SerpAPI search client. `transport(params, timeout)` returns (HTTP status, JSON payload)
+    and raises TimeoutError or ConnectionError; it defaults to a GET on SERPAPI_ENDPOINT through a
+    pooled requests.Session.
+    """
+
+    def __init__(self, endpoint=SERPAPI_ENDPOINT, timeout=20.0, max_retries=2, backoff=0.5, max_backoff=8.0,
+                 failure_threshold=5, cooldown=30.0, rate=None, burst=None, pool_size=8, transport=None):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.pool_size = pool_size
+        self.transport = transport or self._http
+        self.quota = None
+        self.set_rate_limit(rate, burst)
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "attempts": 0, "retries": 0, "timeouts": 0,
+                      "connection_errors": 0, "rate_limited": 0, "server_errors": 0, "api_errors": 0,
+                      "rejected": 0, "quota_rejected": 0}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._session = None
+        self._lock = threading.Lock()
+
+    def set_rate_limit(self, rate, burst=None):
+        """Allows on average `rate` searches per second, `burst` at once (None removes the limit)."""
+        self.quota = TokenBucket(rate, burst) if rate else None
+
+    # ------------------------
+    # HTTP
+    # ------------------------
+    def _http(self, params, timeout):
+        import requests
+
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # Retries are ours; the adapter only keeps up to pool_size connections alive
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        try:
+            response = self._session.get(self.endpoint, params=params, timeout=timeout)
+        except requests.Timeout as e:
+            raise TimeoutError(str(e))
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            raise ConnectionError(str(e)) # Includes connections dropped mid-response
+        except requests.RequestException as e: # Redirect loops, bad URLs, undecodable bodies
+            raise SerpApiError(f"SerpAPI request failed: {e}")
+        count("api_bytes.serpapi", len(response.content))
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {"error": response.text[:200] or response.reason}
+        return response.status_code, payload
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    # ------------------------
+    # Search
+    # ------------------------
+    def search(self, params, timeout=None):
+        """
+        Runs one search and returns SerpAPI's JSON payload. `timeout` is the deadline in seconds for
+        the whole call, retries and quota waits included. Raises SerpApiError when it fails.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        wait = self.breaker.allow()
+        if wait:
+            self._count("rejected")
+            raise SerpApiUnavailable(f"SerpAPI is failing; searches paused for {wait:.0f}s", wait)
+
+        self._count("calls")
+        started = time.monotonic()
+        try:
+            payload = self._attempts(params, deadline)
+        except SerpApiQuotaExceeded:
+            self._count("quota_rejected") # Our own limit, not a SerpAPI failure
+            self.breaker.release()
+            raise
+        except SerpApiError as e:
+            self._finish("failed", started)
+            self.breaker.record(not e.transient) # A rejected search still means SerpAPI is up
+            raise
+        except Exception as e:
+            # Anything unexpected from the transport still counts as a failed call, and must not
+            # leave a half-open breaker waiting for a trial that never reports back
+            self._finish("failed", started)
+            self.breaker.record(False)
+            failure = SerpApiError(f"SerpAPI request failed: {e!r}")
+            failure.transient = True
+            raise failure from e
+        self._finish("succeeded", started)
+        self.breaker.record(True)
+        return payload
+
+    def _attempts(self, params, deadline):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+                if time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                time.sleep(delay)
+            remaining = deadline - time.monotonic()
+            if self.quota is not None and not self.quota.acquire(timeout=remaining):
+                raise SerpApiQuotaExceeded("SerpAPI quota guard: no search available before the deadline",
+                                           1.0 / self.quota.rate)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return self._attempt(params, remaining)
+            except _RetryableError as e:
+                self._count(e.kind)
+                error = e
+                log.debug("SerpAPI attempt %d failed: %s", attempt + 1, e)
+
+        if error is None or error.kind == "timeouts":
+            raise SerpApiTimeout(f"SerpAPI did not answer within the deadline ({error or 'no time left'})")
+        failure = SerpApiError(f"SerpAPI request failed after {attempt + 1} attempts: {error}")
+        failure.transient = True
+        failure.retry_after = self.breaker.cooldown if error.kind == "rate_limited" else None
+        raise failure
+
+    def _attempt(self, params, timeout):
+        self._count("attempts")
+        count("api_calls.serpapi")
+        try:
+            status, payload = self.transport(params, timeout)
+        except TimeoutError as e:
+            raise _RetryableError("timeouts", f"timed out ({e})")
+        except ConnectionError as e:
+            raise _RetryableError("connection_errors", f"connection error ({e})")
+
+        message = payload.get("error") if isinstance(payload, dict) else "unexpected response"
+        if status == 429:
+            raise _RetryableError("rate_limited", f"HTTP 429: {message}")
+        if status >= 500:
+            raise _RetryableError("server_errors", f"HTTP {status}: {message}")
+        if status >= 400 or (message and _NO_RESULTS not in message):
+            self._count("api_errors")
+            raise SerpApiError(f"SerpAPI rejected the search (HTTP {status}): {message}")
+        return payload
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _finish(self, stat, started):
+        with self._lock:
+            self.stats[stat] += 1
+            self._latencies.append(time.monotonic() - started)
+
+    # ------------------------
+    # Metrics
+    # ------------------------
+    def metrics(self):
+        """Latency percentiles (ms), error rates, breaker state and quota use as a JSON-ready dict."""
+        with self._lock:
+            stats = dict(self.stats)
+            latencies = list(self._latencies)
+        attempts = stats["attempts"]
+        errors = {k: stats[k] for k in ("timeouts", "connection_errors", "rate_limited", "server_errors", "api_errors")}
+        metrics = {
+            **stats,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p95": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            },
+            "error_rate": round(stats["failed"] / stats["calls"], 4) if stats["calls"] else 0.0,
+            "attempt_error_rate": round(sum(errors.values()) / attempts, 4) if attempts else 0.0,
+            "breaker": {"state": self.breaker.state, "opens": self.breaker.opens},
+            "quota": None,
+        }
+        if self.quota is not None:
+            metrics["quota"] = {
+                "rate": self.quota.rate,
+                "burst": self.quota.capacity,
+                "available": round(self.quota.tokens, 2),
+                "used": attempts,
+                "waited_s": round(self.quota.waited, 2),
+            }
+        return metrics
+
+    def summary(self):
+        """One-line summary for the CLI."""
+        m = self.metrics()
+        latency = m["latency_ms"]
+        text = (f"SerpAPI: {m['calls']} calls, {m['failed']} failed ({m['error_rate']:.0%}), "
+                f"{m['retries']} retries, p50 {latency['p50'] or 0:.0f} ms, p95 {latency['p95'] or 0:.0f} ms, "
+                f"breaker {m['breaker']['state']}")
+        if m["quota"]:
+            text += f", quota waits {m['quota']['waited_s']:.1f}s"
+        return text
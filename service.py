@@ -0,0 +1,307 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from aiohttp import web
+
+import ShoppingConciarage as concierge
+from instrumentation import configure_logging, configure_profiling, log
+from result_index import ResultIndex
+from serpapi_client import SerpApiError, SerpApiTimeout
+
+# ------------------------
+# HTTP Service
+# ------------------------
+# Non-interactive JSON API over the same search, scoring, preference and export
+# functions the CLI uses. Sized for the Fly VM (2 shared vCPUs, 1 GB):
+#   - blocking work (SerpAPI, Sheets, SQLite) runs on a bounded thread pool,
+#   - at most MAX_IN_FLIGHT requests are processed at once and at most MAX_QUEUED wait;
+#     beyond that, or after QUEUE_TIMEOUT seconds of waiting, requests get 503 + Retry-After,
+#   - every request is cut off after REQUEST_TIMEOUT seconds with 504; its slot stays taken
+#     until its blocking work has actually finished, so abandoned work still counts as load,
+#   - a failing SerpAPI answers 503 + Retry-After (breaker open, quota, transient errors),
+#     504 (SerpAPI timed out) or 502 (SerpAPI rejected the search), never an empty result.
+#
+# Endpoints:
+#   GET  /health
+#   GET  /metrics                SerpAPI latency percentiles, error rates, breaker state and quota use
+#   POST /search/targeted        {"category", "keywords": [], "attributes": {}, "max_pages"?, "target"?,
+#                                 "variants"?: [{"keywords", "attributes"}, ...]}  (filtered from the same fetch)
+#   POST /search/exploratory     {"category", "priorities"?: {attr: 1-5}, "top_k"?: 5, "save"?: false}
+#   GET  /preferences/{category}
+#   PUT  /preferences/{category} {"preferences": {...}, "note"?: ""}
+#   POST /export                 {"sheet_name"?, "products"?: [...], "search"?: {targeted search body}, "append"?: false}
+
+# Defaults; main() overrides them from PORT / SERVICE_* in the environment or .env (load_settings)
+PORT = 8080
+WORKER_THREADS = 16
+MAX_IN_FLIGHT = WORKER_THREADS # Admitted work never waits for a thread
+MAX_QUEUED = 64
+QUEUE_TIMEOUT = 5.0
+REQUEST_TIMEOUT = 60.0
+
+
+def load_settings():
+    """Reads the service limits from the environment, once .env has been loaded."""
+    global PORT, WORKER_THREADS, MAX_IN_FLIGHT, MAX_QUEUED, QUEUE_TIMEOUT, REQUEST_TIMEOUT
+    concierge.load_env()
+    PORT = int(os.getenv("PORT", PORT))
+    WORKER_THREADS = int(os.getenv("SERVICE_WORKER_THREADS", WORKER_THREADS))
+    MAX_IN_FLIGHT = int(os.getenv("SERVICE_MAX_IN_FLIGHT", WORKER_THREADS))
+    MAX_QUEUED = int(os.getenv("SERVICE_MAX_QUEUED", MAX_QUEUED))
+    QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", QUEUE_TIMEOUT))
+    REQUEST_TIMEOUT = float(os.getenv("SERVICE_REQUEST_TIMEOUT", REQUEST_TIMEOUT))
+
+
+class RequestError(Exception):
+    """Invalid request body; answered with 400."""
+
+
+class AdmissionControl:
+    """Limits concurrently processed requests and the length of the waiting line."""
+
+    def __init__(self, max_in_flight, max_queued):
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.max_queued = max_queued
+        self.waiting = 0
+
+    async def acquire(self, timeout):
+        """Returns True once a slot is held, False if the line is full or the wait timed out."""
+        if self.waiting >= self.max_queued:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.slots.release()
+
+
+def _error(status, message, **headers):
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+def _search_error(e):
+    if isinstance(e, SerpApiTimeout):
+        return _error(504, f"Product search timed out: {e}")
+    if e.retry_after or e.transient:
+        return _error(503, f"Product search is unavailable: {e}", **{"Retry-After": str(round(e.retry_after or 5))})
+    return _error(502, f"Product search failed: {e}")
+
+@web.middleware
+async def limits_middleware(request, handler):
+    if request.path in ("/health", "/metrics"):
+        return await handler(request)
+
+    admission = request.app["admission"]
+    if not await admission.acquire(QUEUE_TIMEOUT):
+        return _error(503, "Server is busy, try again shortly.", **{"Retry-After": "2"})
+    request["blocking"] = [] # Worker pool jobs started by this request
+    try:
+        return await asyncio.wait_for(handler(request), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        return _error(504, f"Request took longer than {REQUEST_TIMEOUT:.0f}s.")
+    except RequestError as e:
+        return _error(400, str(e))
+    except SerpApiError as e:
+        log.warning("Request %s %s: %s", request.method, request.path, e)
+        return _search_error(e)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Request %s %s failed", request.method, request.path)
+        return _error(500, f"Internal error: {e}")
+    finally:
+        pending = [job for job in request["blocking"] if not job.done()]
+        if pending:
+            asyncio.ensure_future(_release_after(admission, pending))
+        else:
+            admission.release()
+
+async def _release_after(admission, jobs):
+    """Frees a timed-out request's slot only once its abandoned worker jobs are done."""
+    try:
+        await asyncio.wait([asyncio.wrap_future(job) for job in jobs])
+    finally:
+        admission.release()
+
+async def run_blocking(request, func, *args, **kwargs):
+    """Runs a blocking concierge function on the worker pool."""
+    job = request.app["executor"].submit(functools.partial(func, *args, **kwargs))
+    if "blocking" in request: # Not set for /health and /metrics
+        request["blocking"].append(job)
+    return await asyncio.wrap_future(job)
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise RequestError("Body must be valid JSON.")
+    if not isinstance(body, dict):
+        raise RequestError("Body must be a JSON object.")
+    return body
+
+def _category(value):
+    if not isinstance(value, str) or not value.strip():
+        raise RequestError("'category' must be a non-empty string.")
+    return value.strip().lower()
+
+def _filters(body):
+    keywords = body.get("keywords", [])
+    attributes = body.get("attributes", {})
+    if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+        raise RequestError("'keywords' must be a list of strings.")
+    if not isinstance(attributes, dict):
+        raise RequestError("'attributes' must be an object.")
+    return [k.lower() for k in keywords], {k.lower(): v for k, v in attributes.items()}
+
+def _positive_int(body, key):
+    value = body.get(key)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+        raise RequestError(f"'{key}' must be a positive integer.")
+    return value
+
+def _targeted_args(body):
+    keywords, attributes = _filters(body)
+    return {
+        "category": _category(body.get("category")),
+        "keywords": keywords,
+        "attributes": attributes,
+        "max_pages": _positive_int(body, "max_pages"),
+        "target": _positive_int(body, "target"),
+    }
+
+def _variants(body):
+    variants = body.get("variants", [])
+    if not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants):
+        raise RequestError("'variants' must be a list of objects.")
+    return [_filters(v) for v in variants]
+
+def _targeted_search(category, keywords, attributes, max_pages=None, target=None, index=None):
+    return list(concierge.search_products_stream(category, keywords, attributes,
+                                                 max_pages=max_pages, target=target, index=index))
+
+def _targeted_search_variants(args, variants):
+    """One fetch; the main filters plus every variant answered from the fetched products' index."""
+    index = ResultIndex()
+    results = _targeted_search(**args, index=index)
+    answered = []
+    for keywords, attributes in variants:
+        products = index.filter(keywords, attributes)
+        answered.append({"keywords": keywords, "attributes": attributes, "count": len(products), "products": products})
+    return results, answered
+
+# ------------------------
+# Handlers
+# ------------------------
+async def health(request):
+    return web.json_response({"status": "ok", "waiting": request.app["admission"].waiting,
+                              "serpapi": concierge.serpapi_client().breaker.state})
+
+async def metrics(request):
+    return web.json_response({"serpapi": concierge.serpapi_client().metrics(),
+                              "serp_cache": dict(concierge.serp_cache().stats)})
+
+async def targeted_search(request):
+    body = await read_json(request)
+    args = _targeted_args(body)
+    variants = _variants(body)
+    if not variants:
+        results = await run_blocking(request, _targeted_search, **args)
+        return web.json_response({"category": args["category"], "count": len(results), "products": results})
+    results, answered = await run_blocking(request, _targeted_search_variants, args, variants)
+    return web.json_response({"category": args["category"], "count": len(results), "products": results,
+                              "variants": answered})
+
+async def exploratory_search(request):
+    body = await read_json(request)
+    category = _category(body.get("category"))
+    priorities = body.get("priorities")
+    if priorities is not None and not (isinstance(priorities, dict) and all(
+            isinstance(v, int) and not isinstance(v, bool) and 1 <= v <= 5 for v in priorities.values())):
+        raise RequestError("'priorities' must map attributes to ratings from 1 to 5.")
+    top_k = _positive_int(body, "top_k") or 5
+    summary, suggested = await run_blocking(request, concierge.describe_category, category)
+
+    if priorities is None:
+        # First step of the exploratory flow: let the client ask the user for ratings
+        return web.json_response({"category": category, "summary": summary, "suggested_attributes": suggested})
+    best, everything = await run_blocking(request, concierge.exploratory_search, category, priorities, top_k=top_k)
+    if body.get("save"):
+        await run_blocking(request, concierge.save_preferences, category, priorities)
+    return web.json_response({
+        "category": category,
+        "summary": summary,
+        "suggested_attributes": suggested,
+        "best_matches": best,
+        "count": len(everything),
+        "products": everything,
+    })
+
+async def get_preferences(request):
+    category = _category(request.match_info["category"])
+    record = await run_blocking(request, concierge.get_saved_preferences, category)
+    if record is None:
+        return _error(404, f"No saved preferences for '{category}'.")
+    return web.json_response(dict(record, category=category))
+
+async def put_preferences(request):
+    category = _category(request.match_info["category"])
+    body = await read_json(request)
+    if not isinstance(body.get("preferences"), dict):
+        raise RequestError("'preferences' must be an object.")
+    await run_blocking(request, concierge.save_preferences, category, body["preferences"], note=body.get("note"))
+    return web.json_response({"category": category, "saved": True})
+
+async def export(request):
+    body = await read_json(request)
+    products = body.get("products")
+    if products is None and "search" in body:
+        search = body["search"] if isinstance(body["search"], dict) else {}
+        products = await run_blocking(request, _targeted_search, **_targeted_args(search))
+    if not isinstance(products, list) or not products:
+        raise RequestError("Provide a non-empty 'products' list or a 'search' to export.")
+
+    sheet_name = body.get("sheet_name") or f"Shopping_Results_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    await run_blocking(request, concierge.export_to_gsheet, products, sheet_name=sheet_name, append=bool(body.get("append")))
+    return web.json_response({"sheet_name": sheet_name, "rows": len(products)})
+
+# ------------------------
+# App Setup
+# ------------------------
+async def _on_startup(app):
+    app["admission"] = AdmissionControl(MAX_IN_FLIGHT, MAX_QUEUED)
+
+async def _on_cleanup(app):
+    app["executor"].shutdown(wait=False, cancel_futures=True)
+
+def create_app():
+    app = web.Application(middlewares=[limits_middleware], client_max_size=2 * 1024 * 1024)
+    app["executor"] = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="concierge")
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/metrics", metrics),
+        web.post("/search/targeted", targeted_search),
+        web.post("/search/exploratory", exploratory_search),
+        web.get("/preferences/{category}", get_preferences),
+        web.put("/preferences/{category}", put_preferences),
+        web.post("/export", export),
+    ])
+    return app
+
+def main():
+    load_settings() # Loads .env first, so LOG_LEVEL, PROFILE_* and SERVICE_* in it apply
+    configure_logging()
+    configure_profiling()
+    web.run_app(create_app(), host="0.0.0.0", port=PORT)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import threading
+import time
+from datetime import timezone
+
+from instrumentation import span
+
+# ------------------------
+# Shared Google Sheets Client
+# ------------------------
+# Authorizes once per process and re-authorizes only shortly before the access
+# token expires. Spreadsheets are remembered by name -> key, so repeated exports
+# open them directly by key instead of running a Drive search each time.
+
+TOKEN_LIFETIME = 3600 # Service account access tokens are valid for one hour
+TOKEN_REFRESH_MARGIN = 300 # Re-authorize this many seconds before expiry
+
+
+class SheetsClientManager:
+    """Thread-safe, long-lived gspread client with a spreadsheet handle cache."""
+
+    def __init__(self, creds_file, scope):
+        self.creds_file = creds_file
+        self.scope = scope
+        self.stats = {"authorizations": 0, "drive_lookups": 0, "handle_hits": 0}
+        self._client = None
+        self._expires_at = 0.0
+        self._keys = {} # sheet name -> spreadsheet key (survives re-authorization)
+        self._handles = {} # spreadsheet key -> Spreadsheet bound to the current client
+        self._lock = threading.RLock()
+        self._name_locks = {}
+
+    def _token_expiry(self, creds):
+        expiry = getattr(creds, "token_expiry", None) or getattr(creds, "expiry", None)
+        if expiry is not None:
+            # oauth2client and google-auth both store expiry as a naive UTC datetime
+            return expiry.replace(tzinfo=timezone.utc).timestamp()
+        return time.time() + TOKEN_LIFETIME
+
+    def client(self):
+        """Returns an authorized client, re-authorizing only if the token is about to expire."""
+        with self._lock:
+            if self._client is None or time.time() >= self._expires_at - TOKEN_REFRESH_MARGIN:
+                # Imported here: the Google auth stack is only loaded by processes that export
+                import gspread
+                from oauth2client.service_account import ServiceAccountCredentials
+
+                with span("sheets.auth"):
+                    creds = ServiceAccountCredentials.from_json_keyfile_name(self.creds_file, self.scope)
+                    self._client = gspread.authorize(creds)
+                self._expires_at = self._token_expiry(creds)
+                self._handles.clear() # Handles hold a reference to the old client
+                self.stats["authorizations"] += 1
+            return self._client
+
+    def _name_lock(self, sheet_name):
+        with self._lock:
+            return self._name_locks.setdefault(sheet_name, threading.Lock())
+
+    def open_or_create(self, sheet_name):
+        """
+        Returns (spreadsheet, created) for `sheet_name`.
+        Concurrent calls for the same name share one lookup, so the sheet is never created twice.
+        """
+        import gspread
+
+        with self._name_lock(sheet_name):
+            client = self.client()
+            key = self._keys.get(sheet_name)
+            if key is not None:
+                with self._lock:
+                    spreadsheet = self._handles.get(key)
+                if spreadsheet is not None:
+                    self.stats["handle_hits"] += 1
+                    return spreadsheet, False
+                try:
+                    spreadsheet = client.open_by_key(key)
+                    with self._lock:
+                        self._handles[key] = spreadsheet
+                    return spreadsheet, False
+                except gspread.exceptions.SpreadsheetNotFound:
+                    self._keys.pop(sheet_name, None) # Deleted or unshared since we cached it
+
+            try:
+                self.stats["drive_lookups"] += 1
+                spreadsheet = client.open(sheet_name)
+                created = False
+            except gspread.exceptions.SpreadsheetNotFound:
+                spreadsheet = client.create(sheet_name)
+                created = True
+
+            with self._lock:
+                self._keys[sheet_name] = spreadsheet.id
+                self._handles[spreadsheet.id] = spreadsheet
+            return spreadsheet, created